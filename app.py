@@ -1,98 +1,54 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import time
 from datetime import datetime, timezone
-import random
 import json
+from topics import catalog
+from events import hub
+from stream_server import STREAM_PORT, ensure_started as ensure_stream_server
+from auth import RateLimited
+from debug_duel import BotDifficulty, DuelClosedError, UsernameTakenError
+from debug_duel.service import get_game
+import metrics
 import os
-from filelock import FileLock
-from streamlit_server_state import server_state, server_state_lock
-from hyperskill_ai_api import HyperskillAIAPI
-from topics import TOPICS_LIST
-import bcrypt
 import secrets
 import logging
-from enum import Enum
 
 logging.basicConfig(level=logging.INFO)
 
-DATA_FILE = "game_state.json"
-LOCK_FILE = "game_state.lock"
+EVENT_POLL_INTERVAL = 1  # seconds between fragment checks for new events
+WORKERS = int(os.environ.get("WORKERS", "1"))  # Streamlit processes sharing the store
+RERUN_EVENTS = {"new_duel", "duel_result", "duel_update"}
 
-ai_api = HyperskillAIAPI(os.environ["AI_API_KEY"], "claude-3-5-sonnet-20240620")
 
-# Initialize session state variables
-if 'user_id' not in st.session_state:
-    st.session_state['user_id'] = None
-if 'in_queue' not in st.session_state:
-    st.session_state.in_queue = False
-if 'duel_id' not in st.session_state:
-    st.session_state.duel_id = None
-if 'selected_lines' not in st.session_state:
-    st.session_state.selected_lines = []
-if 'last_update' not in st.session_state:
-    st.session_state.last_update = time.time()
-if 'secret_key' not in st.session_state:
-    st.session_state['secret_key'] = secrets.token_hex(16)
-if 'current_topic' not in st.session_state:
-    st.session_state.current_topic = random.choice(TOPICS_LIST)
-
-class BotDifficulty(Enum):
-    EASY = "easy"
-    HARD = "hard"
-
-
-def generate_bot_response(duel):
-    system_prompt = f"""
-    You are an AI assistant tasked with explaining the bugs in a code snippet. The code snippet contains exactly three bugs related to the topic of {duel['topic']}. Your task is to explain these bugs concisely and accurately.
-    """
-    user_prompt = f"""
-    Here is the code snippet with three bugs:
-
-    {duel['code_snippet']}
-
-    Please explain the three bugs in this code snippet. Be concise and accurate in your explanations. Format your response as a list with three items, each explaining one bug.
-    """
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
-
-    result = ai_api.get_chat_completion(messages)
-    return result
-
-
-def load_state():
-    with FileLock(LOCK_FILE):
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                return json.load(f)
-        return {"users": {}, "queue": [], "duels": {}}
-
-
-def save_state(state):
-    with FileLock(LOCK_FILE):
-        with open(DATA_FILE, "w") as f:
-            json.dump(state, f)
+def init_session_state():
+    """Sets the session state variables a new session starts with."""
+    if 'user_id' not in st.session_state:
+        st.session_state['user_id'] = None
+    if 'in_queue' not in st.session_state:
+        st.session_state.in_queue = False
+    if 'duel_id' not in st.session_state:
+        st.session_state.duel_id = None
+    if 'selected_lines' not in st.session_state:
+        st.session_state.selected_lines = []
+    if 'event_seq' not in st.session_state:
+        st.session_state.event_seq = hub.seq
+    if 'run_times' not in st.session_state:
+        st.session_state.run_times = []
+    if 'secret_key' not in st.session_state:
+        st.session_state['secret_key'] = secrets.token_hex(16)
 
 
-class User:
-    def __init__(self, username, password):
-        state = load_state()
-        self.id = str(len(state["users"]) + 1)
-        self.username = username
-        self.password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        self.rating = 1000
-        state["users"][self.id] = self.__dict__
-        save_state(state)
+@st.cache_resource
+def session_runs():
+    """Script runs per session key, shared by all sessions of the process."""
+    return {}
 
 
-def authenticate_user(username, password):
-    state = load_state()
-    for user in state["users"].values():
-        if user["username"] == username and bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
-            return user["id"]
-    return None
+def rerun(reason):
+    """st.rerun, counted per reason so the metrics show what makes sessions rerun."""
+    metrics.incr(f"reruns_{reason}")
+    st.rerun()
 
 
 def login_user():
@@ -100,11 +56,15 @@ def login_user():
     username = st.text_input("Username", key="login_username")
     password = st.text_input("Password", type="password", key="login_password")
     if st.button("Login"):
-        user_id = authenticate_user(username, password)
+        try:
+            user_id = get_game().authenticate(username, password)
+        except RateLimited as e:
+            st.error(f"Too many failed attempts. Try again in {e.retry_after:.0f} seconds.")
+            return
         if user_id:
             st.session_state['user_id'] = user_id
             st.success(f"Welcome back, {username}!")
-            st.rerun()
+            rerun("login")
         else:
             st.error("Invalid username or password")
 
@@ -120,240 +80,50 @@ def register_user():
         elif not username or not password:
             st.error("Username and password are required")
         else:
-            state = load_state()
-            if any(user["username"] == username for user in state["users"].values()):
+            if get_game().username_taken(username):
                 st.error("Username already exists")
             else:
-                new_user = User(username, password)
-                st.session_state['user_id'] = new_user.id
+                try:
+                    user_id = get_game().register(username, password)
+                except UsernameTakenError:
+                    st.error("Username already exists")
+                    return
+                st.session_state['user_id'] = user_id
                 st.success("Registration successful!")
-                st.rerun()
+                rerun("register")
 
 
 def logout_user():
     if st.sidebar.button("Logout"):
+        hub.disconnect(st.session_state['user_id'])
         for key in list(st.session_state.keys()):
             del st.session_state[key]
-        st.rerun()
-
-
-def generate_code_snippet():
-    topic = random.choice(TOPICS_LIST)
-
-    system_prompt = f"""
-    You are a mischievous coding assistant tasked with creating intentionally flawed code snippets. Your goal is to generate a code snippet on the specified {topic[0]} using the {topic[1]}. However, you MUST introduce EXACTLY THREE BUGS into the code that are DIRECTLY RELATED to the given topic. These bugs should be subtle enough to not be immediately obvious, but significant enough to cause issues when the code is run or implemented.
-    """
-    user_prompt = f"""
-    Do not provide any explanations, comments, or annotations within the code. Output only the raw code snippet with the embedded bugs. The bugs should be logical errors, syntax mistakes, or implementation flaws that are specific to the topic and programming language provided.
-
-    Remember, your task is to create code that appears functional at first glance but contains hidden flaws. Be creative in your bug placement, ensuring they are diverse and not trivially fixable. The code should compile (if applicable to the language) but fail or produce incorrect results when executed.
-    DO NOT write empty lines in the code snippet!
-    MAXIMUM AMOUNT OF LINES IN CODE SNIPPET: 10. NO MORE!
-    After generated code, explain the errors in generated code snippet in the following format:
-    **BUGS LIST**
-    Line number: correct implementation for this line (with fixed bug)
-    DO NOT WRITE ANYTHING OTHER THAN THAT!
-    Remember: there are EXACLTY 3 LINES WITH BUGS! NO MORE!
-    """
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
-
-    result = ai_api.get_chat_completion(messages)
-    code_part, bugs_part = result.split("**BUGS LIST**")
-
-    bug_lines = []
-    for line in bugs_part.strip().split('\n'):
-        line_number = int(line.split(':')[0].split()[-1])
-        bug_lines.append(line_number)
-    return code_part.strip(), bug_lines
-
-
-class Duel:
-    def __init__(self, user1_id, user2_id):
-        self.id = str(int(time.time() * 1000))
-        self.user1_id = user1_id
-        self.user2_id = user2_id
-        self.winner_id = None
-        self.code_snippet, self.error_lines = generate_code_snippet()
-        self.start_time = datetime.now(timezone.utc).isoformat()
-        self.errors_found = {user1_id: [], user2_id: []}
-        self.submission_time = {user1_id: None, user2_id: None}
-        self.accepted_by = []
-        self.is_bot_duel = False
-        self.bot_difficulty = None  # This will be a string now
-        self.topic = random.choice(TOPICS_LIST)
-
-
-def create_bot_duel(user_id, difficulty):
-    bot_id = f"bot_{difficulty.value}"
-    new_duel = Duel(user_id, bot_id)
-    new_duel.is_bot_duel = True
-    new_duel.bot_difficulty = difficulty.value  # Store as a string
-    state = load_state()
-    state["duels"][new_duel.id] = new_duel.__dict__
-    save_state(state)
-    return str(new_duel.id)
-
-
-def bot_find_errors(duel):
-    difficulty = BotDifficulty(duel["bot_difficulty"])  # Convert string back to enum
-    if difficulty == BotDifficulty.HARD:
-        return duel["error_lines"]
-    elif difficulty == BotDifficulty.EASY:
-        correct_lines = duel["error_lines"]
-        all_lines = range(1, len(duel["code_snippet"].split('\n')) + 1)
-        wrong_lines = [line for line in all_lines if line not in correct_lines]
-
-        num_correct = random.randint(1, len(correct_lines))
-        num_wrong = random.randint(0, 2)
-
-        bot_guess = random.sample(correct_lines, num_correct) + random.sample(wrong_lines, num_wrong)
-        return sorted(bot_guess)
-
-
-def find_opponent():
-    state = load_state()
-    if len(state["queue"]) > 1:
-        user1_id = state["queue"].pop(0)
-        user2_id = state["queue"].pop(0)
-        new_duel = Duel(user1_id, user2_id)
-        state["duels"][new_duel.id] = new_duel.__dict__
-        save_state(state)
-        return str(new_duel.id)
-    return None
-
-
-def check_for_active_duel(user_id):
-    state = load_state()
-    for duel_id, duel in state["duels"].items():
-        if user_id in [duel["user1_id"], duel["user2_id"]] and duel["winner_id"] is None:
-            return duel_id
-    return None
-
-
-def send_sse_event(user_id, event_type, data):
-    with server_state_lock["sse_events"]:
-        server_state.sse_events[user_id] = json.dumps({
-            "type": event_type,
-            **data
-        })
-
-
-def end_duel(duel_id, winner_id):
-    state = load_state()
-    duel = state["duels"][duel_id]
-
-    if duel["is_bot_duel"]:
-        user_id = duel["user1_id"]
-        bot_id = duel["user2_id"]
-        user = state["users"][user_id]
-
-        if winner_id == user_id:
-            # User wins against bot
-            rating_change = 10 if duel["bot_difficulty"] == BotDifficulty.EASY.value else 20
-            user["rating"] += rating_change
-        else:
-            # User loses against bot
-            rating_change = -5 if duel["bot_difficulty"] == BotDifficulty.EASY.value else -10
-            user["rating"] += rating_change
-
-        duel["winner_id"] = winner_id
-        save_state(state)
-
-        send_sse_event(user_id, "duel_result", {
-            "result": "win" if winner_id == user_id else "lose",
-            "new_rating": user["rating"],
-            "rating_change": rating_change
-        })
-    else:
-        loser_id = duel["user2_id"] if winner_id == duel["user1_id"] else duel["user1_id"]
-
-        logging.info(f"Ending duel {duel_id}. Winner: {winner_id}, Loser: {loser_id}")
-
-        winner_rating_before = state["users"][winner_id]["rating"]
-        loser_rating_before = state["users"][loser_id]["rating"]
-
-        winner_rating, loser_rating = update_ratings(winner_id, loser_id)
-
-        logging.info(f"Winner rating: {winner_rating_before} -> {winner_rating}")
-        logging.info(f"Loser rating: {loser_rating_before} -> {loser_rating}")
-
-        # Update the state with new ratings
-        state["users"][winner_id]["rating"] = winner_rating
-        state["users"][loser_id]["rating"] = loser_rating
-        duel["winner_id"] = winner_id
-
-        save_state(state)
-
-        # Verify the state was saved correctly
-        verification_state = load_state()
-        logging.info(f"Verified winner rating: {verification_state['users'][winner_id]['rating']}")
-        logging.info(f"Verified loser rating: {verification_state['users'][loser_id]['rating']}")
-
-        # Notify both users about the duel result and updated ratings
-        send_sse_event(winner_id, "duel_result", {
-            "result": "win",
-            "new_rating": winner_rating
-        })
-        send_sse_event(loser_id, "duel_result", {
-            "result": "lose",
-            "new_rating": loser_rating
-        })
-
-        # Update leaderboard for all users
-    update_leaderboard_for_all_users()
-
-
-def update_ratings(winner_id, loser_id):
-    state = load_state()
-    K = 32
-    winner = state["users"][winner_id]
-    loser = state["users"][loser_id]
-
-    expected_winner = 1 / (1 + 10 ** ((loser["rating"] - winner["rating"]) / 400))
-    expected_loser = 1 - expected_winner
-
-    new_winner_rating = winner["rating"] + K * (1 - expected_winner)
-    new_loser_rating = loser["rating"] + K * (0 - expected_loser)
-
-    logging.info(f"Calculated new ratings - Winner: {new_winner_rating}, Loser: {new_loser_rating}")
-
-    return new_winner_rating, new_loser_rating
-
-
-def update_leaderboard_for_all_users():
-    state = load_state()  # Ensure we're using the most recent state
-    leaderboard = get_leaderboard()
-    logging.info(f"Updating leaderboard: {leaderboard}")
-    for user_id in state["users"]:
-        send_sse_event(user_id, "leaderboard_update", {
-            "leaderboard": leaderboard
-        })
-        # Also send an update for the user's personal rating
-        send_sse_event(user_id, "rating_update", {
-            "new_rating": state["users"][user_id]["rating"]
-        })
-
-
-def get_leaderboard():
-    state = load_state()
-    sorted_users = sorted(state["users"].values(), key=lambda x: x["rating"], reverse=True)
-    return [{"username": user["username"], "rating": user["rating"]} for user in sorted_users[:5]]
+        rerun("logout")
 
 
 def show_duel_interface(duel_id, user_id):
-    state = load_state()
-    duel = state["duels"][duel_id]
+    duel = get_game().get_duel(duel_id)
+    # watch_events reruns the page when the duel changes after this
+    st.session_state.duel_version = duel["version"]
 
     if duel["is_bot_duel"]:
         opponent_id = duel["user2_id"]  # This should be the bot's ID (e.g., "bot_easy" or "bot_hard")
         opponent = {"username": f"{duel['bot_difficulty'].capitalize()} Bot"}
     else:
         opponent_id = duel["user2_id"] if user_id == duel["user1_id"] else duel["user1_id"]
-        opponent = state["users"][opponent_id]
+        opponent = get_game().get_user(opponent_id)
+
+    if duel.get("status") == "pending":
+        st.info(f"Opponent found: {opponent['username']}. Preparing the code snippet...")
+        return
+
+    if duel.get("status") == "cancelled":
+        st.warning("The duel was cancelled because the code snippet could not be generated.")
+        if st.button("Start New Duel"):
+            st.session_state.duel_id = None
+            st.session_state.selected_lines = []
+            rerun("new_duel")
+        return
 
     # Check if the duel has already ended
     if duel["winner_id"]:
@@ -380,10 +150,13 @@ def show_duel_interface(duel_id, user_id):
             st.write(
                 f"Opponent incorrect errors: {len([e for e in duel['errors_found'][opponent_id] if e not in duel['error_lines']])}")
 
+        if st.button("Explain the Bugs", key="explain_bugs"):
+            st.write_stream(get_game().stream_explanation(duel))
+
         if st.button("Start New Duel"):
             st.session_state.duel_id = None
             st.session_state.selected_lines = []
-            st.rerun()
+            rerun("new_duel")
         return
 
     # Initialize selected_lines if not present
@@ -448,24 +221,14 @@ def show_duel_interface(duel_id, user_id):
     st.write("Selected error lines:", ", ".join(map(str, sorted(st.session_state.selected_lines))))
 
     if st.button("Submit Guesses", key="submit_guesses"):
-        duel["errors_found"][user_id] = st.session_state.selected_lines
-        duel["submission_time"][user_id] = datetime.now(timezone.utc).isoformat()
-
-        if duel["is_bot_duel"]:
-            bot_errors = bot_find_errors(duel)
-            duel["errors_found"][opponent_id] = bot_errors
-            duel["submission_time"][opponent_id] = datetime.now(timezone.utc).isoformat()
-            save_state(state)
-            determine_winner(duel_id)
-            st.rerun()
-        else:
-            save_state(state)
-            if duel["submission_time"][user_id] and duel["submission_time"][opponent_id]:
-                determine_winner(duel_id)
-                st.rerun()
-            else:
-                st.info("Waiting for your opponent to submit their guesses...")
-                st.rerun()
+        try:
+            duel = get_game().submit_guesses(duel_id, user_id, list(st.session_state.selected_lines))
+        except DuelClosedError:
+            # Settled or cancelled since this page was rendered; the rerun shows how it ended
+            rerun("duel_changed")
+        if not all(duel["submission_time"].values()):
+            st.info("Waiting for your opponent to submit their guesses...")
+        rerun("submit")
 
     # Display opponent's progress
     if duel["is_bot_duel"]:
@@ -475,60 +238,162 @@ def show_duel_interface(duel_id, user_id):
         st.write(f"Opponent errors found: {opponent_errors_found}")
 
 
-def determine_winner(duel_id):
-    state = load_state()
-    duel = state["duels"][duel_id]
-    user1_id, user2_id = duel["user1_id"], duel["user2_id"]
-
-    user1_correct = len([e for e in duel['errors_found'][user1_id] if e in duel['error_lines']])
-    user1_incorrect = len([e for e in duel['errors_found'][user1_id] if e not in duel['error_lines']])
-    user2_correct = len([e for e in duel['errors_found'][user2_id] if e in duel['error_lines']])
-    user2_incorrect = len([e for e in duel['errors_found'][user2_id] if e not in duel['error_lines']])
-
-    if user1_correct > user2_correct or (user1_correct == user2_correct and user1_incorrect < user2_incorrect):
-        winner_id = user1_id
-    elif user2_correct > user1_correct or (user1_correct == user2_correct and user2_incorrect < user1_incorrect):
-        winner_id = user2_id
-    else:
-        winner_id = None  # It's a tie
-
-    if winner_id:
-        end_duel(duel_id, winner_id)
-    else:
-        # Handle tie
-        duel["winner_id"] = "tie"
-        save_state(state)
-        if duel["is_bot_duel"]:
-            send_sse_event(user1_id, "duel_result", {"result": "tie"})
-        else:
-            send_sse_event(user1_id, "duel_result", {"result": "tie"})
-            send_sse_event(user2_id, "duel_result", {"result": "tie"})
+def show_duel_history(user_id):
+    """Archived duels of the user, one page at a time."""
+    with st.sidebar.expander("Duel history"):
+        duels, next_cursor = get_game().history(user_id, st.session_state.get('history_cursor'))
+        if not duels:
+            st.write("No archived duels yet.")
+        for duel in duels:
+            if duel["is_bot_duel"]:
+                opponent = f"{duel['bot_difficulty'].capitalize()} Bot"
+            else:
+                opponent_id = duel["user2_id"] if user_id == duel["user1_id"] else duel["user1_id"]
+                opponent = (get_game().get_user(opponent_id) or {}).get("username", "unknown")
+            if duel["winner_id"] in ("tie", "cancelled"):
+                result = duel["winner_id"].capitalize()
+            else:
+                result = "Won" if duel["winner_id"] == user_id else "Lost"
+            st.write(f"{duel['start_time'][:10]} vs {opponent}: {result}")
+        if next_cursor is not None and st.button("Older duels", key="history_older"):
+            st.session_state.history_cursor = next_cursor
+            rerun("history")
+        if st.session_state.get('history_cursor') is not None and st.button("Newest duels", key="history_newest"):
+            st.session_state.history_cursor = None
+            rerun("history")
+
+
+def update_leaderboard():
+    """Writes the leaderboard, read again only after a new leaderboard_update broadcast or a full script run."""
+    seq = hub.broadcast_seq("leaderboard_update")
+    if st.session_state.get('leaderboard_seq') != seq:
+        st.session_state.leaderboard_seq = seq
+        st.session_state.leaderboard = get_game().leaderboard()
+    st.write("\n".join(f"{i + 1}. {user['username']}: {user['rating']:.0f}"
+                       for i, user in enumerate(st.session_state.leaderboard)))
+
+
+@st.fragment(run_every=EVENT_POLL_INTERVAL)
+def leaderboard_panel():
+    # Game.ranking broadcasts a leaderboard_update when it picks up other workers' results
+    get_game().ranking()
+    update_leaderboard()
+
+
+@st.fragment(run_every=EVENT_POLL_INTERVAL)
+def watch_events(user_id):
+    """Reruns the page only when an event that changes what it shows arrives."""
+    metrics.incr("event_checks")
+    events, st.session_state.event_seq = hub.fetch_since(user_id, st.session_state.event_seq)
+    if any(json.loads(event)["type"] in RERUN_EVENTS for event in events):
+        rerun("event")
+    # Events only reach sessions of the worker that published them; a change
+    # made by a session on another worker shows up in the stored duel
+    duel_id = st.session_state.get('duel_id')
+    if WORKERS > 1 and duel_id and st.session_state.get('duel_version') is not None:
+        duel = get_game().get_duel(duel_id)
+        if duel is not None and duel["version"] != st.session_state.duel_version:
+            rerun("duel_changed")
+
+
+@st.fragment(run_every=EVENT_POLL_INTERVAL)
+def queue_status(user_id):
+    topic = get_random_topic()
+    st.write(f"Current topic: {topic.concept} - {topic.language}")
+    # Matches are made by the matchmaker's ticker; a match made on this worker arrives
+    # as a new_duel event (see watch_events), one made on another is looked up
+    duel_id = get_game().active_duel_id(user_id) if WORKERS > 1 else None
+    if duel_id:
+        st.session_state.duel_id = duel_id
+        st.session_state.in_queue = False
+        rerun("matched")
+    elif st.button("Leave Queue", key="leave_queue"):
+        get_game().leave_queue(user_id)
+        st.session_state.in_queue = False
+        rerun("leave_queue")
+
+
+def record_script_run():
+    """Tracks full script runs per session over the last minute and publishes
+    the average over active sessions as the reruns_per_session_per_minute gauge."""
+    now = time.time()
+    st.session_state.run_times = [t for t in st.session_state.run_times if now - t < 60] + [now]
+    runs = session_runs()
+    runs[st.session_state['secret_key']] = (now, len(st.session_state.run_times))
+    for session_key, (last_run, _) in list(runs.items()):
+        if now - last_run >= 60:
+            runs.pop(session_key, None)
+    rates = [count for _, count in list(runs.values())]
+    metrics.incr("script_runs")
+    metrics.set_gauge("reruns_per_session_per_minute", sum(rates) / len(rates))
+
+
+def collect_state_metrics():
+    return {
+        "state_size_bytes": get_game().store.size_bytes(),
+        "active_duels": get_game().store.count_active_duels(),
+        "connected_sessions": len(hub.connected_users()),
+    }
 
 
-def update_leaderboard(placeholder):
-    leaderboard = get_leaderboard()
-    placeholder.write(
-        "\n".join([f"{i + 1}. {user['username']}: {user['rating']:.0f}" for i, user in enumerate(leaderboard)]))
+def initialize_sse_events():
+    ensure_stream_server()
+    metrics.add_collector("state", collect_state_metrics)
+    metrics.start_http_server()
+    get_game().start()
+    # Marks the session as connected and lets its browser subscribe to /stream
+    if st.session_state.get('user_id'):
+        hub.touch(st.session_state['user_id'])
+        hub.register_token(st.session_state['secret_key'], st.session_state['user_id'])
+
+
+LIVE_UPDATES_HTML = """
+<div id="live" style="font-family: sans-serif; font-size: 14px; color: #555;">Connecting to live updates...</div>
+<script>
+let page;
+try { page = window.parent.location; } catch (e) { page = window.location; }
+const live = document.getElementById("live");
+const source = new EventSource(`${page.protocol}//${page.hostname}:__STREAM_PORT__/stream?token=__TOKEN__`);
+const messages = {
+    new_duel: data => data.status === "cancelled" ? "The duel was cancelled." : "Your duel is ready!",
+    duel_update: data => `Your opponent submitted ${data.opponent_errors} guesses.`,
+    duel_result: data => ({win: "You won the duel!", lose: "You lost the duel.", tie: "The duel ended in a tie."})[data.result],
+    rating_update: data => `Your rating is now ${data.new_rating.toFixed(0)} (${data.rating_change >= 0 ? "+" : ""}${data.rating_change.toFixed(0)}).`,
+};
+source.onopen = () => { live.textContent = "Live updates connected."; };
+source.onerror = () => { live.textContent = "Live updates disconnected, retrying..."; };
+source.onmessage = event => {
+    const data = JSON.parse(event.data);
+    if (messages[data.type]) {
+        live.textContent = messages[data.type](data);
+    }
+};
+</script>
+"""
 
 
-def initialize_sse_events():
-    with server_state_lock["sse_events"]:
-        if "sse_events" not in server_state:
-            server_state.sse_events = {}
+def live_updates():
+    """Shows the user's events as the stream server pushes them, without a rerun.
+    Rendered in an iframe: scripts in st.markdown are never executed."""
+    html = LIVE_UPDATES_HTML.replace("__STREAM_PORT__", str(STREAM_PORT))
+    # st.iframe replaces components.html in newer Streamlit releases
+    embed = getattr(st, "iframe", None) or components.html
+    embed(html.replace("__TOKEN__", st.session_state['secret_key']), height=40)
 
 
 def get_random_topic():
-    return random.choice(TOPICS_LIST)
+    # Only shown while queueing, so it is not counted as served
+    return catalog.sample()
 
 
 def main():
+    init_session_state()
     initialize_sse_events()
+    record_script_run()
 
     st.set_page_config(page_title="Debug Duel", page_icon="👾", layout="wide")
     st.title("👾 Debug Duel")
 
-    state = load_state()
-
     if not st.session_state['user_id']:
         col1, col2 = st.columns(2)
         with col1:
@@ -538,12 +403,13 @@ def main():
     else:
         logout_user()
         user_id = st.session_state['user_id']
-        if user_id in state["users"]:
-            user = state["users"][user_id]
+        user = get_game().get_user(user_id)
+        if user is not None:
             st.sidebar.write(f"Player: {user['username']}")
             st.sidebar.write(f"Rating: {user['rating']:.0f}")
+            show_duel_history(user_id)
 
-            active_duel_id = check_for_active_duel(user_id)
+            active_duel_id = get_game().active_duel_id(user_id)
             if active_duel_id:
                 st.session_state.duel_id = active_duel_id
                 st.session_state.in_queue = False
@@ -555,170 +421,47 @@ def main():
                 col1, col2, col3 = st.columns(3)
                 with col1:
                     if st.button("Find Human Opponent", key="find_opponent"):
-                        state["queue"].append(user_id)
-                        save_state(state)
-                        st.session_state.in_queue = True
-                        st.rerun()
+                        duel_id = get_game().find_opponent(user_id)
+                        if duel_id:
+                            st.session_state.duel_id = duel_id
+                        else:
+                            st.session_state.in_queue = True
+                        rerun("find_opponent")
                 with col2:
                     if st.button("Play Against Easy Bot", key="easy_bot"):
-                        duel_id = create_bot_duel(user_id, BotDifficulty.EASY)
+                        duel_id = get_game().create_bot_duel(user_id, BotDifficulty.EASY)
                         st.session_state.duel_id = duel_id
-                        st.rerun()
+                        rerun("bot_duel")
                 with col3:
                     if st.button("Play Against Hard Bot", key="hard_bot"):
-                        duel_id = create_bot_duel(user_id, BotDifficulty.HARD)
+                        duel_id = get_game().create_bot_duel(user_id, BotDifficulty.HARD)
                         st.session_state.duel_id = duel_id
-                        st.rerun()
+                        rerun("bot_duel")
             else:
                 st.info("Searching for a human opponent...")
-                topic_placeholder = st.empty()
-                duel_id = find_opponent()
-                if duel_id:
-                    st.session_state.duel_id = duel_id
-                    st.session_state.in_queue = False
-                    # Notify both users about the new duel
-                    with server_state_lock["sse_events"]:
-                        duel = state["duels"].get(duel_id)
-                        if duel:
-                            for participant_id in [duel["user1_id"], duel["user2_id"]]:
-                                if participant_id:
-                                    server_state.sse_events[participant_id] = json.dumps(
-                                        {"type": "new_duel", "duel_id": duel_id})
-                        else:
-                            st.error(f"Duel with id {duel_id} not found in state.")
-                    st.rerun()
-                elif st.button("Leave Queue", key="leave_queue"):
-                    state["queue"] = [uid for uid in state["queue"] if uid != user_id]
-                    save_state(state)
-                    st.session_state.in_queue = False
-                    st.rerun()
+                queue_status(user_id)
+
+            watch_events(user_id)
 
         else:
             st.error("User data not found. Please log in again.")
             st.session_state['user_id'] = None
-            st.rerun()
+            rerun("missing_user")
 
     # Display leaderboard
     st.sidebar.write("---")
     st.sidebar.write("Leaderboard:")
-    leaderboard_placeholder = st.sidebar.empty()
-    update_leaderboard(leaderboard_placeholder)
-
-    # Add JavaScript for SSE and real-time updates
-    st.markdown("""
-    <script>
-    const evtSource = new EventSource("/stream");
-    evtSource.onmessage = function(event) {
-        const data = JSON.parse(event.data);
-        switch(data.type) {
-            case "duel_result":
-                handleDuelResult(data);
-                break;
-            case "leaderboard_update":
-                updateLeaderboard(data.leaderboard);
-                break;
-            case "duel_update":
-                updateDuelInterface(data);
-                break;
-            case "new_duel":
-                handleNewDuel(data);
-                break;
-            case "rating_update":
-                updatePersonalRating(data.new_rating);
-                break;
-        }
-    }
-
-    function handleDuelResult(data) {
-        if (data.result === "win") {
-            alert(`Congratulations! You won the duel! Rating change: ${data.rating_change}`);
-        } else if (data.result === "lose") {
-            alert(`You lost the duel. Better luck next time! Rating change: ${data.rating_change}`);
-        } else if (data.result === "tie") {
-            alert("The duel ended in a tie!");
-        }
-        updatePersonalRating(data.new_rating);
-    }
-
-    function updateLeaderboard(leaderboard) {
-        const leaderboardElement = document.querySelector('.element-container:contains("Leaderboard:")');
-        if (leaderboardElement) {
-            const leaderboardHtml = leaderboard.map((user, index) => 
-                `${index + 1}. ${user.username}: ${user.rating.toFixed(0)}`
-            ).join('<br>');
-            leaderboardElement.innerHTML = `<p>Leaderboard:</p>${leaderboardHtml}`;
-        }
-    }
-
-    function updatePersonalRating(newRating) {
-        const ratingElement = document.querySelector('p:contains("Rating:")');
-        if (ratingElement) {
-            ratingElement.textContent = `Rating: ${newRating.toFixed(0)}`;
-        }
-    }
-
-    function updateDuelInterface(data) {
-        const opponentErrorsElement = document.querySelector('p:contains("Opponent errors found:")');
-        if (opponentErrorsElement) {
-            opponentErrorsElement.textContent = `Opponent errors found: ${data.opponent_errors}`;
-        }
-    }
-
-    function handleNewDuel(data) {
-        alert("Opponent found! The duel is starting.");
-        location.reload();
-    }
-
-    // Function to update the current topic with blinking effect
-    function updateTopic() {
-        const topicElement = document.querySelector('div[data-testid="stMarkdownContainer"] p:contains("Current topic:")');
-        if (topicElement) {
-            topicElement.style.transition = 'opacity 0.5s';
-            topicElement.style.opacity = 0;
-            setTimeout(() => {
-                topicElement.style.opacity = 1;
-            }, 500);
-        }
-    }
-
-    // Update topic every second while in queue
-    let topicInterval;
-    function startTopicUpdate() {
-        topicInterval = setInterval(updateTopic, 1000);
-    }
-
-    function stopTopicUpdate() {
-        clearInterval(topicInterval);
-    }
-
-    // Check if in queue and start/stop topic update accordingly
-    function checkQueueStatus() {
-        const inQueue = document.querySelector('div:contains("Searching for a human opponent...")');
-        if (inQueue) {
-            startTopicUpdate();
-        } else {
-            stopTopicUpdate();
-        }
-    }
+    with st.sidebar:
+        # Read again on every full run
+        st.session_state.pop('leaderboard_seq', None)
+        # Only logged-in sessions keep theirs live
+        if st.session_state['user_id']:
+            leaderboard_panel()
+        else:
+            update_leaderboard()
 
-    // Initial check and periodic check for queue status
-    checkQueueStatus();
-    setInterval(checkQueueStatus, 1000);
-    </script>
-    """, unsafe_allow_html=True)
-
-    # Periodically check for updates and update the topic
-    if st.session_state.in_queue:
-        current_time = time.time()
-        if 'last_topic_update' not in st.session_state or current_time - st.session_state.last_topic_update > 1:
-            st.session_state.last_topic_update = current_time
-            topic = get_random_topic()
-            topic_placeholder.write(f"Current topic: {topic[0]} - {topic[1]}")
-            st.rerun()
-
-    if time.time() - st.session_state.last_update > 15:  # Check every 15 seconds
-        st.session_state.last_update = time.time()
-        st.rerun()
+    if st.session_state['user_id']:
+        live_updates()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import metrics
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", "2"))
+MAX_FAILED_LOGINS = int(os.environ.get("MAX_FAILED_LOGINS", "5"))
+FAILED_LOGIN_WINDOW = 300  # seconds a failed login counts against the username
+
+
+class RateLimited(Exception):
+    """Too many failed logins for a username; `retry_after` is in seconds."""
+
+    def __init__(self, username, retry_after):
+        super().__init__(f"Too many failed logins for {username}, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def hash_rounds(hashed):
+    """Cost factor of a bcrypt hash such as "$2b$12$..."."""
+    return int(hashed.split("$")[2])
+
+
+@metrics.timed_function("bcrypt_hash")
+def hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+@metrics.timed_function("bcrypt_check")
+def checkpw(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """bcrypt hashing on a small bounded thread pool.
+
+    bcrypt releases the GIL, so hashing on `workers` threads caps the CPU a burst
+    of logins can take while the script threads only wait for the result.
+    Failed logins are counted per username: past `max_failures` within `window`
+    seconds `verify` raises RateLimited before any hashing is done.
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=AUTH_WORKERS, max_failures=MAX_FAILED_LOGINS,
+                 window=FAILED_LOGIN_WINDOW):
+        self.rounds = rounds
+        self.max_failures = max_failures
+        self.window = window
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._failures = defaultdict(deque)
+
+    def hash(self, password):
+        return self._pool.submit(hashpw, password, self.rounds).result()
+
+    def verify(self, username, password, hashed):
+        """Checks a login. Returns (ok, new_hash); new_hash is set when the stored
+        hash was made with another cost factor and should replace it."""
+        self._check_rate(username)
+        ok = self._pool.submit(checkpw, password, hashed).result()
+        if not ok:
+            self._record_failure(username)
+            return False, None
+        with self._lock:
+            self._failures.pop(username, None)
+        if hash_rounds(hashed) != self.rounds:
+            metrics.incr("auth_rehashes")
+            return True, self.hash(password)
+        return True, None
+
+    def _check_rate(self, username):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username)
+            if not failures:
+                return
+            while failures and now - failures[0] > self.window:
+                failures.popleft()
+            if not failures:
+                del self._failures[username]
+            elif len(failures) >= self.max_failures:
+                metrics.incr("auth_rate_limited")
+                raise RateLimited(username, self.window - (now - failures[0]))
+
+    def _record_failure(self, username):
+        with self._lock:
+            self._failures[username].append(time.monotonic())
+
+
+hasher = PasswordHasher()
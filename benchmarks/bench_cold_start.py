@@ -0,0 +1,85 @@
+"""Times the cold start of a worker in fresh interpreters, against a budget.
+
+Measures importing the game service (what the page imports before its first
+render) and building the process-wide Game on first use, in an empty
+directory, then lists the modules that take the longest to import.
+Exits with status 1 when a median is over its budget.
+
+    python -m benchmarks.bench_cold_start
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUNS = 7
+IMPORT_BUDGET = 0.1  # seconds, median of `import debug_duel.service`
+FIRST_GAME_BUDGET = 0.4  # seconds, median of the import plus the first get_game()
+TOP_IMPORTS = 10
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import debug_duel.service
+print(time.perf_counter() - started)
+"""
+
+FIRST_GAME_SCRIPT = """
+import time
+started = time.perf_counter()
+from debug_duel.service import get_game
+get_game()
+print(time.perf_counter() - started)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def environment():
+    env = dict(os.environ, AI_API_KEY="bench", METRICS_ENABLED="1")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+    return env
+
+
+def time_script(script, runs):
+    """Median seconds `script` reports over `runs` fresh interpreters, each in an empty directory."""
+    timings = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run([sys.executable, "-c", script], cwd=directory, env=environment(),
+                                    capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def slowest_imports(module, count):
+    """(self seconds, module) of the `count` modules slowest to import along with `module`."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            env=environment(), capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        imports.append((int(self_us) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    over_budget = False
+    for name, script, budget in (("import debug_duel.service", IMPORT_SCRIPT, IMPORT_BUDGET),
+                                 ("first get_game()", FIRST_GAME_SCRIPT, FIRST_GAME_BUDGET)):
+        median = time_script(script, RUNS)
+        over_budget |= median > budget
+        print(f"{name:<26} median {median * 1000:7.1f}ms over {RUNS} runs, "
+              f"budget {budget * 1000:.0f}ms{'  OVER BUDGET' if median > budget else ''}")
+
+    print("\nSlowest imports of debug_duel.service (self time):")
+    for seconds, module in slowest_imports("debug_duel.service", TOP_IMPORTS):
+        print(f"  {seconds * 1000:7.1f}ms  {module}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
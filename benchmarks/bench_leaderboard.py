@@ -0,0 +1,63 @@
+"""Compares the incremental Leaderboard with sorting every user on each call.
+
+Each round changes the ratings of two players (one finished duel) and reads the top 5
+and one player's rank, which is what a page render after a duel does.
+
+    python -m benchmarks.bench_leaderboard
+"""
+import random
+import time
+
+from leaderboard import Leaderboard
+
+ROUNDS = 200
+
+
+def make_users(count):
+    return {str(i): {"id": str(i), "username": f"user{i}", "rating": random.uniform(800, 1600)}
+            for i in range(1, count + 1)}
+
+
+def full_sort_round(users, winner_id, loser_id):
+    users[winner_id]["rating"] += 16
+    users[loser_id]["rating"] -= 16
+    sorted_users = sorted(users.values(), key=lambda x: x["rating"], reverse=True)
+    top = [{"username": user["username"], "rating": user["rating"]} for user in sorted_users[:5]]
+    rank = next(i for i, user in enumerate(sorted_users, 1) if user["id"] == winner_id)
+    return top, rank
+
+
+def incremental_round(users, ranking, winner_id, loser_id):
+    users[winner_id]["rating"] += 16
+    users[loser_id]["rating"] -= 16
+    ranking.update(winner_id, users[winner_id]["rating"])
+    ranking.update(loser_id, users[loser_id]["rating"])
+    return ranking.top(5), ranking.rank(winner_id)
+
+
+def run(count):
+    users = make_users(count)
+    pairs = [random.sample(list(users), 2) for _ in range(ROUNDS)]
+
+    start = time.perf_counter()
+    for winner_id, loser_id in pairs:
+        full_sort_round(users, winner_id, loser_id)
+    full_sort_time = (time.perf_counter() - start) / ROUNDS
+
+    start = time.perf_counter()
+    ranking = Leaderboard(users.values())
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for winner_id, loser_id in pairs:
+        incremental_round(users, ranking, winner_id, loser_id)
+    incremental_time = (time.perf_counter() - start) / ROUNDS
+
+    print(f"{count:>7} users: full sort {full_sort_time * 1e3:8.3f} ms/round, "
+          f"incremental {incremental_time * 1e3:8.3f} ms/round "
+          f"({full_sort_time / incremental_time:,.0f}x), initial build {build_time * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    for count in (10_000, 100_000):
+        run(count)
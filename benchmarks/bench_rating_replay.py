@@ -0,0 +1,74 @@
+"""Times a full rating replay over a synthetic duel history: the replay loop over
+results in memory, then `replay_store` over a populated SQLite store, which is
+what rating_replay.py runs (reading the users and the duel results included).
+
+    python -m benchmarks.bench_rating_replay
+"""
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.stub_ai_server import SNIPPET_RESPONSE
+from rating_replay import replay_ratings, replay_store
+from state_store import SqliteStateStore
+
+USERS = 10_000
+DUELS = 1_000_000
+STORE_DUELS = 200_000
+BOT_SHARE = 0.3
+
+
+def make_results(user_ids, count):
+    results = []
+    for i in range(count):
+        if random.random() < BOT_SHARE:
+            user_id = random.choice(user_ids)
+            difficulty = random.choice(("easy", "hard"))
+            bot_id = f"bot_{difficulty}"
+            results.append((i, str(i), user_id, bot_id, random.choice((user_id, bot_id)), True, difficulty))
+        else:
+            user1_id, user2_id = random.sample(user_ids, 2)
+            winner_id = random.choice((user1_id, user2_id, user1_id, user2_id, "tie"))
+            results.append((i, str(i), user1_id, user2_id, winner_id, False, None))
+    return results
+
+
+def populate(store, user_ids, results):
+    """Stores the users and the results as full duels, snippets included."""
+    users = {user_id: {"id": user_id, "username": f"user{user_id}", "password": "hash", "rating": 1000}
+             for user_id in user_ids}
+    duels = {}
+    for i, duel_id, user1_id, user2_id, winner_id, is_bot_duel, bot_difficulty in results:
+        duels[duel_id] = {
+            "id": duel_id, "user1_id": user1_id, "user2_id": user2_id, "winner_id": winner_id,
+            "start_time": f"2024-01-01T00:00:00.{i:06d}+00:00", "status": "active", "version": 2,
+            "code_snippet": SNIPPET_RESPONSE, "error_lines": [3, 4, 5],
+            "errors_found": {user1_id: [3, 4], user2_id: [5]}, "submission_time": {user1_id: None, user2_id: None},
+            "accepted_by": [], "is_bot_duel": is_bot_duel, "bot_difficulty": bot_difficulty,
+            "topic": ["Loops", "Python"],
+        }
+    store.save({"users": users, "queue": [], "duels": duels})
+
+
+def main():
+    user_ids = [str(i) for i in range(1, USERS + 1)]
+    results = make_results(user_ids, DUELS)
+    for k_factor in (32, 24):
+        started = time.perf_counter()
+        ratings = replay_ratings(user_ids, results, k_factor=k_factor)
+        elapsed = time.perf_counter() - started
+        print(f"K={k_factor}: {DUELS} duels, {USERS} users in {elapsed:.2f}s, "
+              f"top rating {max(ratings.values()):.0f}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteStateStore(os.path.join(directory, "game_state.db"))
+        populate(store, user_ids, results[:STORE_DUELS])
+        started = time.perf_counter()
+        ratings = replay_store(store)
+        elapsed = time.perf_counter() - started
+        print(f"replay_store on SQLite: {STORE_DUELS} duels, {len(ratings)} users in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Drives concurrent simulated players through complete human duels with debug_duel.Game, without Streamlit.
+
+Every player registers, logs in, then keeps queueing, submitting guesses and
+waiting for the result until the target number of duels has been played.
+The AI provider is replaced by benchmarks.stub_ai_server. After each run the
+stored ratings are checked against a replay of the duel history, and every
+finished duel against its submissions, to count lost updates.
+
+    python -m benchmarks.load_test --players 20 --duels 50 --backend json --backend sqlite
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import metrics
+from auth import PasswordHasher
+from debug_duel import Game
+from events import EventHub
+from hyperskill_ai_api import HyperskillAIAPI
+from rating_replay import replay_store
+from state_store import JsonStateStore, SqliteStateStore
+from benchmarks.stub_ai_server import StubAIServer
+
+PLAYERS = 20
+DUELS = 50
+BCRYPT_ROUNDS = 4  # the minimum; login cost is not what this measures
+POLL_INTERVAL = 0.005
+TIMEOUT = 30  # seconds a player waits for any one step
+
+
+class Run:
+    """Latencies and progress of one load test run."""
+
+    def __init__(self, target_duels):
+        self.target_duels = target_duels
+        self.finished = 0
+        self.timeouts = 0
+        self.done = threading.Event()
+        self.latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def timed(self, name, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.record(name, started)
+        return result
+
+    def record(self, name, started):
+        with self._lock:
+            self.latencies[name].append(time.perf_counter() - started)
+
+    def duel_finished(self):
+        with self._lock:
+            self.finished += 1
+            if self.finished >= self.target_duels:
+                self.done.set()
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+def wait_for(condition, run):
+    """Polls `condition` until it returns something truthy; None on timeout or once the run is over."""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline and not run.done.is_set():
+        result = condition()
+        if result:
+            return result
+        time.sleep(POLL_INTERVAL)
+    if not run.done.is_set():
+        run.timed_out()
+    return None
+
+
+def started_duel(game, duel_id):
+    duel = game.get_duel(duel_id)
+    return duel if duel["status"] != "pending" else None
+
+
+def play(game, run, number):
+    username, password = f"player{number}", f"secret{number}"
+    user_id = run.timed("register", game.register, username, password)
+    run.timed("login", game.authenticate, username, password)
+
+    while not run.done.is_set():
+        started = time.perf_counter()
+        game.find_opponent(user_id)
+        duel_id = wait_for(lambda: game.active_duel_id(user_id), run)
+        if duel_id is None:
+            game.leave_queue(user_id)
+            return
+        duel = wait_for(lambda: started_duel(game, duel_id), run)
+        if duel is None:
+            return
+        run.record("queue_to_start", started)
+
+        lines = range(1, len(duel["code_snippet"].split("\n")) + 1)
+        run.timed("submit", game.submit_guesses, duel_id, user_id, random.sample(lines, 3))
+        started = time.perf_counter()
+        if wait_for(lambda: game.get_duel(duel_id)["winner_id"], run) is None:
+            return
+        run.record("submit_to_result", started)
+        if user_id == duel["user1_id"]:
+            run.duel_finished()
+
+
+def count_lost_updates(store):
+    """Ratings that differ from a replay of the duel history, and finished duels missing a submission."""
+    replayed = replay_store(store)
+    state = store.load()
+    ratings = sum(1 for user in state["users"].values() if abs(replayed[user["id"]] - user["rating"]) > 1e-6)
+    submissions = sum(1 for duel in state["duels"].values()
+                      if duel["winner_id"] is not None and not all(duel["submission_time"].values()))
+    return ratings, submissions
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def run_backend(backend, players, duels, ai_url, directory):
+    if backend == "json":
+        store = JsonStateStore(os.path.join(directory, "load_test.json"), os.path.join(directory, "load_test.lock"))
+    else:
+        store = SqliteStateStore(os.path.join(directory, "load_test.db"))
+    game = Game(store, HyperskillAIAPI("stub", "stub-model", url=ai_url), events=EventHub(),
+                hasher=PasswordHasher(rounds=BCRYPT_ROUNDS))
+    game.matchmaker.start(interval=0.05)
+    run = Run(duels)
+    before = metrics.snapshot()
+    lock_before = metrics.get_timing("state_lock_wait")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=play, args=(game, run, i), name=f"player-{i}") for i in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    game.duel_workers.shutdown()
+
+    after = metrics.snapshot()
+    lock_waits, lock_wait = (now - then for now, then in zip(metrics.get_timing("state_lock_wait"), lock_before))
+    lost_ratings, lost_submissions = count_lost_updates(store)
+
+    print(f"\n[{backend}] {players} players, {run.finished} duels in {elapsed:.2f}s "
+          f"({run.finished / elapsed:.1f} duels/s), {run.timeouts} timeouts")
+    for name, values in run.latencies.items():
+        print(f"  {name:<17} n={len(values):<5} p50={percentile(values, 50) * 1000:8.1f}ms "
+              f"p99={percentile(values, 99) * 1000:8.1f}ms")
+    print(f"  lock wait: {lock_wait:.2f}s over {lock_waits} write transactions "
+          f"({lock_wait / lock_waits * 1000 if lock_waits else 0:.2f}ms each), "
+          f"{after.get('state_update_conflicts', 0) - before.get('state_update_conflicts', 0)} conflicts retried")
+    print(f"  lost updates: {lost_ratings} ratings, {lost_submissions} submissions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=PLAYERS)
+    parser.add_argument("--duels", type=int, default=DUELS, help="duels to finish per backend")
+    parser.add_argument("--backend", action="append", choices=["json", "sqlite"],
+                        help="store to test, may be repeated (default: both)")
+    parser.add_argument("--ai-delay", type=float, default=0.0, help="seconds the stub AI takes per completion")
+    args = parser.parse_args()
+
+    server = StubAIServer(delay=args.ai_delay).start()
+    try:
+        for backend in args.backend or ["json", "sqlite"]:
+            with tempfile.TemporaryDirectory() as directory:
+                run_backend(backend, args.players, args.duels, server.url, directory)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
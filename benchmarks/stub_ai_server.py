@@ -0,0 +1,138 @@
+"""Local stand-in for the AI provider's chat-completion endpoint.
+
+Answers every request with a canned snippet in the format generate_code_snippet
+expects. Requests with `"stream": true` get the answer as Server-Sent Events,
+a few words per chunk with `chunk_delay` between them, unless `streaming` is off;
+others get one JSON body after `delay`. Error statuses queued in `errors`
+are answered first, one per request, to exercise retries.
+
+    python -m benchmarks.stub_ai_server --port 8600
+
+or from code:
+
+    server = StubAIServer(port=0).start()
+    api = HyperskillAIAPI("key", "model", url=server.url)
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SNIPPET_RESPONSE = """def average(values):
+    total = 0
+    for i in range(1, len(values)):
+        total += values[i]
+    return total / len(values) - 1
+print(average([1, 2, 3]))
+**BUGS LIST**
+Line 3: for i in range(len(values)):
+Line 4: total += values[i]
+Line 5: return total / len(values)"""
+
+
+class StubAIServer:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, chunk_delay=0.01, content=SNIPPET_RESPONSE,
+                 streaming=True):
+        self.delay = delay
+        self.streaming = streaming
+        self.chunk_delay = chunk_delay
+        self.content = content
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # most requests being answered at once
+        # (status, Retry-After or None) answered, one per request, before the content
+        self.errors = deque()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/chat-completion"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="stub-ai-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    self._answer(payload)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _answer(self, payload):
+                if server.errors:
+                    self._error(*server.errors.popleft())
+                    return
+                # `content` may also be a function of the request payload
+                content = server.content(payload) if callable(server.content) else server.content
+                if payload.get("stream") and server.streaming:
+                    self._stream(content)
+                else:
+                    time.sleep(server.delay)
+                    body = json.dumps({"content": content}).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _stream(self, content):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = content.split(" ")
+                for i in range(0, len(words), 3):
+                    text = " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+                    self._write_chunk(f"data: {json.dumps({'content': text})}\n\n")
+                    time.sleep(server.chunk_delay)
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _error(self, status, retry_after):
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", retry_after)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubAIServer(args.host, args.port, delay=args.delay)
+    print(f"Stub AI provider listening on {stub.url}")
+    stub.httpd.serve_forever()
@@ -0,0 +1,11 @@
+"""Debug Duel's game logic, usable without Streamlit.
+
+    from debug_duel import Game
+    game = Game(open_store(), HyperskillAIAPI(api_key, model))
+    user_id = game.register("ada", "secret")
+
+`debug_duel.service.get_game()` returns the instance configured from the
+environment that the Streamlit page uses, built on first use.
+"""
+from debug_duel.core import (BotDifficulty, Duel, DuelClosedError, Game, UsernameTakenError, bot_find_errors,
+                             find_winner, settle_duel, update_ratings)
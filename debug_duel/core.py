@@ -0,0 +1,499 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from enum import Enum
+
+from auth import hasher as default_hasher
+from duel_archive import start_sweeper as start_archive_sweeper
+from events import hub
+from leaderboard import Leaderboard
+from matchmaking import Matchmaker
+import metrics
+from rating_replay import ELO_K, BOT_RATING_CHANGES, INITIAL_RATING
+from snippet_pool import SnippetPool
+from state_store import duel_players
+from topics import catalog as default_catalog, topic_id
+
+from debug_duel.snippets import generate_code_snippet, bot_response_messages
+
+DUEL_WORKERS = int(os.environ.get("DUEL_WORKERS", "4"))  # threads attaching snippets to new duels
+PENDING_TIMEOUT = 300  # seconds after which a duel found still pending on start is cancelled, not prepared again
+# Seconds a live worker is given to finish preparing a duel before a starting worker takes it over
+PREPARATION_GRACE = int(os.environ.get("PREPARATION_GRACE", "60"))
+LEADERBOARD_REFRESH = 5  # seconds between syncs of the ranking with the stored ratings
+
+
+class BotDifficulty(Enum):
+    EASY = "easy"
+    HARD = "hard"
+
+
+class UsernameTakenError(Exception):
+    pass
+
+
+class DuelClosedError(Exception):
+    """Guesses submitted for a duel that isn't being played: still pending, cancelled or already settled."""
+
+
+class Duel:
+    def __init__(self, user1_id, user2_id, topic):
+        # Random rather than time based, so workers creating duels in the same millisecond don't collide
+        self.id = uuid.uuid4().hex
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+        self.winner_id = None
+        self.topic = (topic.concept, topic.language)
+        self.topic_id = topic.id
+        # Filled in by Game.attach_snippet on a worker thread
+        self.status = "pending"
+        self.code_snippet = None
+        self.error_lines = []
+        self.start_time = datetime.now(timezone.utc).isoformat()
+        self.errors_found = {user1_id: [], user2_id: []}
+        self.submission_time = {user1_id: None, user2_id: None}
+        self.accepted_by = []
+        self.is_bot_duel = False
+        self.bot_difficulty = None  # This will be a string now
+        self.version = 0
+
+
+def update_ratings(winner, loser):
+    K = ELO_K
+
+    expected_winner = 1 / (1 + 10 ** ((loser["rating"] - winner["rating"]) / 400))
+    expected_loser = 1 - expected_winner
+
+    new_winner_rating = winner["rating"] + K * (1 - expected_winner)
+    new_loser_rating = loser["rating"] + K * (0 - expected_loser)
+
+    logging.info(f"Calculated new ratings - Winner: {new_winner_rating}, Loser: {new_loser_rating}")
+
+    return new_winner_rating, new_loser_rating
+
+
+def bot_find_errors(duel):
+    difficulty = BotDifficulty(duel["bot_difficulty"])  # Convert string back to enum
+    if difficulty == BotDifficulty.HARD:
+        return duel["error_lines"]
+    elif difficulty == BotDifficulty.EASY:
+        correct_lines = duel["error_lines"]
+        all_lines = range(1, len(duel["code_snippet"].split('\n')) + 1)
+        wrong_lines = [line for line in all_lines if line not in correct_lines]
+
+        num_correct = random.randint(1, len(correct_lines))
+        num_wrong = random.randint(0, 2)
+
+        bot_guess = random.sample(correct_lines, num_correct) + random.sample(wrong_lines, num_wrong)
+        return sorted(bot_guess)
+
+
+def find_winner(duel):
+    """Returns the id of the player with more correct guesses (fewer wrong ones on a draw), or None for a tie."""
+    user1_id, user2_id = duel["user1_id"], duel["user2_id"]
+
+    user1_correct = len([e for e in duel['errors_found'][user1_id] if e in duel['error_lines']])
+    user1_incorrect = len([e for e in duel['errors_found'][user1_id] if e not in duel['error_lines']])
+    user2_correct = len([e for e in duel['errors_found'][user2_id] if e in duel['error_lines']])
+    user2_incorrect = len([e for e in duel['errors_found'][user2_id] if e not in duel['error_lines']])
+
+    if user1_correct > user2_correct or (user1_correct == user2_correct and user1_incorrect < user2_incorrect):
+        return user1_id
+    elif user2_correct > user1_correct or (user1_correct == user2_correct and user2_incorrect < user1_incorrect):
+        return user2_id
+    return None
+
+
+def settle_duel(tx, duel_id, winner_id):
+    """Applies the duel result and rating changes within one transaction; a `winner_id` of None is a tie.
+    Returns the users whose rating changed with the change, and the events to send once it is committed."""
+    duel = tx.get_duel(duel_id)
+    if duel["winner_id"] is not None:
+        logging.info(f"Duel {duel_id} has already ended with winner {duel['winner_id']}")
+        return [], []
+
+    if winner_id is None:
+        duel["winner_id"] = "tie"
+        tx.put_duel(duel)
+        return [], [(user_id, "duel_result", {"result": "tie"}) for user_id in duel_players(duel)]
+
+    if duel["is_bot_duel"]:
+        user_id = duel["user1_id"]
+        user = tx.get_user(user_id)
+
+        win_change, lose_change = BOT_RATING_CHANGES[duel["bot_difficulty"]]
+        # The user either wins or loses against the bot
+        rating_change = win_change if winner_id == user_id else lose_change
+        user["rating"] += rating_change
+
+        duel["winner_id"] = winner_id
+        tx.put_user(user)
+        tx.put_duel(duel)
+
+        return [(user, rating_change)], [(user_id, "duel_result", {
+            "result": "win" if winner_id == user_id else "lose",
+            "new_rating": user["rating"],
+            "rating_change": rating_change
+        })]
+
+    loser_id = duel["user2_id"] if winner_id == duel["user1_id"] else duel["user1_id"]
+
+    logging.info(f"Ending duel {duel_id}. Winner: {winner_id}, Loser: {loser_id}")
+
+    winner = tx.get_user(winner_id)
+    loser = tx.get_user(loser_id)
+    winner_rating_before = winner["rating"]
+    loser_rating_before = loser["rating"]
+
+    winner_rating, loser_rating = update_ratings(winner, loser)
+
+    logging.info(f"Winner rating: {winner_rating_before} -> {winner_rating}")
+    logging.info(f"Loser rating: {loser_rating_before} -> {loser_rating}")
+
+    # Update the state with new ratings
+    winner["rating"] = winner_rating
+    loser["rating"] = loser_rating
+    duel["winner_id"] = winner_id
+
+    tx.put_user(winner)
+    tx.put_user(loser)
+    tx.put_duel(duel)
+
+    return [(winner, winner_rating - winner_rating_before), (loser, loser_rating - loser_rating_before)], [
+        (winner_id, "duel_result", {"result": "win", "new_rating": winner_rating}),
+        (loser_id, "duel_result", {"result": "lose", "new_rating": loser_rating}),
+    ]
+
+
+class Game:
+    """Debug Duel's game logic against one store, with no UI attached.
+
+    Everything that has to be consistent between processes lives in the store,
+    so any number of workers can run a Game against the same store. What each
+    keeps for itself is derived from it: the matchmaker resyncs with the stored
+    queue, the ranking is synced when other workers have changed ratings,
+    and `events` (by default the process' EventHub) only reaches the sessions
+    of this worker.
+    """
+
+    def __init__(self, store, ai_api, events=hub, hasher=default_hasher, archive=None, llm_cache=None,
+                 snippet_cache=None, duel_workers=DUEL_WORKERS, catalog=default_catalog):
+        self.store = store
+        self.ai_api = ai_api
+        self.events = events
+        self.hasher = hasher
+        self.archive = archive
+        self.llm_cache = llm_cache
+        self.snippet_cache = snippet_cache
+        self.catalog = catalog
+        self.snippet_pool = SnippetPool(self.generate_snippet, catalog.ids())
+        self.matchmaker = Matchmaker(store, self.create_match)
+        self.duel_workers = ThreadPoolExecutor(max_workers=duel_workers, thread_name_prefix="duel-setup")
+        self._ranking = None
+        self._ranking_version = None
+        self._ranking_checked = 0
+        self._ranking_lock = threading.Lock()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Starts the background work: snippet pre-generation, matchmaking and archiving,
+        and picks up the duels left pending by a restart. Only the first call does anything."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        self.recover_pending_duels()
+        self.snippet_pool.start()
+        self.matchmaker.start()
+        if self.archive is not None:
+            start_archive_sweeper(self.store, self.archive)
+
+    # Users
+
+    def register(self, username, password):
+        """Creates a user and returns their id. Raises UsernameTakenError."""
+        user = {"id": None, "username": username, "password": self.hasher.hash(password), "rating": INITIAL_RATING}
+
+        def insert(tx):
+            # Checked inside the transaction in case someone registered the same name meanwhile
+            if tx.find_user_id(username) is not None:
+                raise UsernameTakenError(username)
+            user["id"] = str(tx.count_users() + 1)
+            tx.put_user(user)
+
+        self.store.update_state(insert)
+        self.ranking().update(user["id"], user["rating"], user["username"])
+        return user["id"]
+
+    def authenticate(self, username, password):
+        """Returns the user id, or None for a wrong username or password. Raises auth.RateLimited."""
+        user_id = self.store.find_user_id(username)
+        if user_id is None:
+            return None
+        user = self.store.get_user(user_id)
+        ok, new_hash = self.hasher.verify(username, password, user["password"])
+        if not ok:
+            return None
+        if new_hash is not None:
+            # The cost factor has changed since this password was hashed
+            def rehash(tx):
+                current = tx.get_user(user_id)
+                if current["password"] == user["password"]:
+                    current["password"] = new_hash
+                    tx.put_user(current)
+
+            self.store.update_state(rehash)
+        return user_id
+
+    def username_taken(self, username):
+        return self.store.find_user_id(username) is not None
+
+    def get_user(self, user_id):
+        return self.store.get_user(user_id)
+
+    # Duels
+
+    def get_duel(self, duel_id):
+        """Looks a duel up in the store, then in the archive of finished duels."""
+        duel = self.store.get_duel(duel_id)
+        if duel is None and self.archive is not None:
+            duel = self.archive.get(duel_id)
+        return duel
+
+    def active_duel_id(self, user_id):
+        return self.store.get_active_duel_id(user_id)
+
+    def history(self, user_id, before=None, limit=10):
+        """One page of the user's archived duels and the cursor of the next one, see DuelArchive.history."""
+        if self.archive is None:
+            return [], None
+        return self.archive.history(user_id, before, limit)
+
+    def generate_snippet(self, topic_id):
+        return generate_code_snippet(self.ai_api, self.catalog.get(topic_id), self.snippet_cache)
+
+    def new_duel(self, user1_id, user2_id):
+        """A Duel on a topic drawn from the catalog; count it with `catalog.record_served` once stored."""
+        return Duel(user1_id, user2_id, self.catalog.sample())
+
+    def create_bot_duel(self, user_id, difficulty):
+        bot_id = f"bot_{difficulty.value}"
+        new_duel = self.new_duel(user_id, bot_id)
+        new_duel.is_bot_duel = True
+        new_duel.bot_difficulty = difficulty.value  # Store as a string
+        self.store.put_duel(new_duel.__dict__)
+        self.catalog.record_served(new_duel.topic_id)
+        self.prepare_duel(new_duel.id)
+        return new_duel.id
+
+    def prepare_duel(self, duel_id):
+        """Attaches a snippet to a pending duel in the background; players get a
+        new_duel event once it can be played."""
+        future = self.duel_workers.submit(self.attach_snippet, duel_id)
+        future.add_done_callback(lambda done: self._check_preparation(duel_id, done))
+
+    def _check_preparation(self, duel_id, future):
+        # Anything attach_snippet didn't handle would otherwise leave the players waiting forever
+        if future.cancelled() or future.exception() is None:
+            return
+        logging.error(f"Preparing duel {duel_id} failed, cancelling it", exc_info=future.exception())
+        try:
+            self.finish_preparation(duel_id, None, [])
+        except Exception:
+            logging.exception(f"Could not cancel duel {duel_id}")
+
+    def recover_pending_duels(self, timeout=PENDING_TIMEOUT, grace=PREPARATION_GRACE):
+        """Prepares the stored pending duels again, in case their preparation died with the
+        worker that was running it. Duels pending for more than `timeout` seconds are cancelled;
+        those younger than `grace` seconds may still be prepared by a live worker, so they are
+        only taken over if they are still pending once it has passed."""
+        now = datetime.now(timezone.utc)
+        for duel in self.store.pending_duels():
+            age = (now - datetime.fromisoformat(duel["start_time"])).total_seconds()
+            if age > timeout:
+                logging.info(f"Cancelling duel {duel['id']}, pending since {duel['start_time']}")
+                self.finish_preparation(duel["id"], None, [])
+            elif age < grace:
+                # attach_snippet skips the duel if it is no longer pending by then
+                timer = threading.Timer(grace - age, self.prepare_duel, (duel["id"],))
+                timer.daemon = True
+                timer.start()
+            else:
+                self.prepare_duel(duel["id"])
+
+    def attach_snippet(self, duel_id):
+        duel = self.store.get_duel(duel_id)
+        if duel is None or duel["status"] != "pending":
+            return
+        # Duels created before topics had ids only carry the topic's text
+        topic = duel.get("topic_id") or topic_id(*duel["topic"])
+        try:
+            code_snippet, error_lines = self.snippet_pool.take(topic)
+        except Exception:
+            logging.exception(f"Could not generate a snippet for duel {duel_id}, cancelling it")
+            code_snippet, error_lines = None, []
+        self.finish_preparation(duel_id, code_snippet, error_lines)
+
+    def finish_preparation(self, duel_id, code_snippet, error_lines):
+        """Makes a pending duel playable with the snippet, or cancels it when `code_snippet` is None."""
+        def attach(tx):
+            duel = tx.get_duel(duel_id)
+            if duel is None or duel["status"] != "pending":
+                # Already prepared by another worker, or cancelled
+                return None
+            if code_snippet is None:
+                duel["status"] = "cancelled"
+                duel["winner_id"] = "cancelled"
+            else:
+                duel["status"] = "active"
+                duel["code_snippet"] = code_snippet
+                duel["error_lines"] = error_lines
+                # The clock starts when the players can see the code
+                duel["start_time"] = datetime.now(timezone.utc).isoformat()
+            tx.put_duel(duel)
+            return duel
+
+        duel = self.store.update_state(attach)
+        if duel is None:
+            return
+        for user_id in duel_players(duel):
+            self.events.send(user_id, "new_duel", {"duel_id": duel_id, "status": duel["status"]})
+
+    # Matchmaking
+
+    def create_match(self, user1_id, user2_id):
+        """Called by the matchmaker for a compatible pair. Returns the new duel id,
+        or None if one of the players has left the queue meanwhile."""
+        new_duel = self.new_duel(user1_id, user2_id)
+
+        def match(tx):
+            # Taking both players out of the queue and recording the duel in one transaction
+            if not (tx.is_queued(user1_id) and tx.is_queued(user2_id)):
+                return None
+            tx.remove_from_queue(user1_id)
+            tx.remove_from_queue(user2_id)
+            tx.put_duel(new_duel.__dict__)
+            return new_duel.id
+
+        duel_id = self.store.update_state(match)
+        if duel_id:
+            self.catalog.record_served(new_duel.topic_id)
+            self.prepare_duel(duel_id)
+        return duel_id
+
+    def find_opponent(self, user_id):
+        """Puts the user in the queue and returns a duel id if a waiting player
+        is already within rating range; otherwise the matchmaker's ticker keeps trying."""
+        self.store.enqueue(user_id)
+        return self.matchmaker.enqueue(user_id, self.store.get_user(user_id)["rating"])
+
+    def leave_queue(self, user_id):
+        self.store.remove_from_queue(user_id)
+        self.matchmaker.remove(user_id)
+
+    # Results
+
+    def submit_guesses(self, duel_id, user_id, selected_lines):
+        """Records the user's guesses, and the bot's in a bot duel. Once both players
+        have submitted, the winner is determined. Returns the updated duel.
+        Raises DuelClosedError unless the duel is being played."""
+        # Applied to the latest stored duel, not the one the player was shown
+        def submit(tx):
+            current = tx.get_duel(duel_id)
+            if current is None or current["status"] != "active" or current["winner_id"] is not None:
+                raise DuelClosedError(duel_id)
+            current["errors_found"][user_id] = selected_lines
+            current["submission_time"][user_id] = datetime.now(timezone.utc).isoformat()
+            if current["is_bot_duel"]:
+                bot_id = current["user2_id"]
+                current["errors_found"][bot_id] = bot_find_errors(current)
+                current["submission_time"][bot_id] = datetime.now(timezone.utc).isoformat()
+            tx.put_duel(current)
+            return current
+
+        duel = self.store.update_state(submit)
+        if all(duel["submission_time"].values()):
+            self.determine_winner(duel_id)
+        else:
+            opponent_id = duel["user2_id"] if user_id == duel["user1_id"] else duel["user1_id"]
+            self.events.send(opponent_id, "duel_update", {
+                "duel_id": duel_id,
+                "opponent_errors": len(selected_lines)
+            })
+        return duel
+
+    def determine_winner(self, duel_id):
+        """Settles the duel from the guesses stored with it, read in the settling transaction."""
+        self._publish_settlement(self.store.update_state(
+            lambda tx: settle_duel(tx, duel_id, find_winner(tx.get_duel(duel_id)))))
+
+    def end_duel(self, duel_id, winner_id):
+        self._publish_settlement(self.store.update_state(lambda tx: settle_duel(tx, duel_id, winner_id)))
+
+    def _publish_settlement(self, settlement):
+        changed_users, events = settlement
+        if not events:
+            return
+
+        ranking = self.ranking()
+        for user, _ in changed_users:
+            ranking.update(user["id"], user["rating"], user["username"])
+
+        # Notify users about the duel result and updated ratings
+        for user_id, event_type, data in events:
+            self.events.send(user_id, event_type, data)
+
+        if not changed_users:
+            return
+        # Serialized once and shared by every session
+        self.events.broadcast("leaderboard_update", {"leaderboard": self.leaderboard()})
+        # Only the players whose rating changed get a personal update
+        for user, rating_change in changed_users:
+            if self.events.is_connected(user["id"]):
+                self.events.send(user["id"], "rating_update", {
+                    "new_rating": user["rating"],
+                    "rating_change": rating_change
+                })
+
+    def explain_bugs(self, duel):
+        # The same snippet always gets the same explanation, so it is worth keeping
+        return self.ai_api.get_chat_completion(bot_response_messages(duel), cache=self.llm_cache)
+
+    def stream_explanation(self, duel):
+        """Like explain_bugs, but yields the explanation in chunks as it is generated."""
+        return self.ai_api.stream_chat_completion(bot_response_messages(duel), cache=self.llm_cache)
+
+    # Ranking
+
+    def ranking(self):
+        """Leaderboard of all users. Updated in place for the results settled here, and synced
+        with the stored ratings at most every LEADERBOARD_REFRESH seconds after any user record changed."""
+        now = time.monotonic()
+        if self._ranking is not None and now - self._ranking_checked < LEADERBOARD_REFRESH:
+            return self._ranking
+        with self._ranking_lock:
+            if self._ranking is not None and now - self._ranking_checked < LEADERBOARD_REFRESH:
+                return self._ranking
+            # Set first, so other threads keep reading the current ranking while this one syncs it
+            self._ranking_checked = now
+            version = self.store.ratings_version()
+            if self._ranking is None:
+                self._ranking = Leaderboard({"id": user_id, "username": username, "rating": rating}
+                                            for user_id, username, rating in self.store.iter_ratings())
+            elif version != self._ranking_version:
+                # Only the changed rows touch the ranking; this worker's own results are already in it
+                metrics.incr("ranking_syncs")
+                if self._ranking.sync(self.store.iter_ratings()):
+                    # Other workers' results reach this worker's sessions like its own
+                    self.events.broadcast("leaderboard_update", {"leaderboard": self._ranking.top(5)})
+            self._ranking_version = version
+        return self._ranking
+
+    def leaderboard(self, n=5):
+        return self.ranking().top(n)
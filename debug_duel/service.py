@@ -0,0 +1,60 @@
+"""The process-wide Game the Streamlit page and other front-ends share.
+
+Streamlit executes the page script again on every rerun, so anything the page
+created at module level (store connections, thread pools, the matchmaker, the
+ranking) was created again each time. Created here, in an imported module, it
+exists once per process.
+
+Nothing is configured at import time: `get_game` builds the store and the AI
+client on first use, so importing this module never fails on a missing
+AI_API_KEY and costs no more than importing the game logic.
+"""
+import os
+import threading
+
+from debug_duel.core import Game
+
+AI_MODEL = "claude-3-5-sonnet-20240620"
+SNIPPET_CACHE_FILE = os.environ.get("SNIPPET_CACHE_FILE", "snippet_cache.db")
+
+_game = None
+_game_lock = threading.Lock()
+
+
+def build_game():
+    """A Game configured from the environment."""
+    # Imported here so that the requests stack is only loaded by the process that talks to the provider
+    from duel_archive import DuelArchive
+    from hyperskill_ai_api import HyperskillAIAPI
+    from llm_cache import LLMCache
+    from state_store import open_store
+
+    return Game(
+        open_store(),
+        HyperskillAIAPI(os.environ["AI_API_KEY"], AI_MODEL),
+        archive=DuelArchive(),
+        llm_cache=LLMCache(),
+        snippet_cache=build_snippet_cache(),
+    )
+
+
+def build_snippet_cache():
+    """With SNIPPET_RECORD set, every snippet that passes validation is stored in SNIPPET_CACHE_FILE,
+    ready for LLMCache.export_corpus; with SNIPPET_REPLAY set, snippets come only from that file."""
+    from llm_cache import LLMCache
+
+    if os.environ.get("SNIPPET_REPLAY"):
+        return LLMCache(SNIPPET_CACHE_FILE, offline=True)
+    if os.environ.get("SNIPPET_RECORD"):
+        return LLMCache(SNIPPET_CACHE_FILE, write_only=True)
+    return None
+
+
+def get_game():
+    """The process-wide Game, built on the first call."""
+    global _game
+    if _game is None:
+        with _game_lock:
+            if _game is None:
+                _game = build_game()
+    return _game
@@ -0,0 +1,63 @@
+import logging
+
+from snippet_parser import parse_snippet, SnippetRejected
+
+SNIPPET_MAX_ATTEMPTS = 3  # generations tried before giving up on an invalid snippet
+
+
+def snippet_messages(topic):
+    """Prompt asking for a snippet on `topic`, a (concept, language) pair, with exactly three bugs."""
+    system_prompt = f"""
+    You are a mischievous coding assistant tasked with creating intentionally flawed code snippets. Your goal is to generate a code snippet on the specified {topic[0]} using the {topic[1]}. However, you MUST introduce EXACTLY THREE BUGS into the code that are DIRECTLY RELATED to the given topic. These bugs should be subtle enough to not be immediately obvious, but significant enough to cause issues when the code is run or implemented.
+    """
+    user_prompt = f"""
+    Do not provide any explanations, comments, or annotations within the code. Output only the raw code snippet with the embedded bugs. The bugs should be logical errors, syntax mistakes, or implementation flaws that are specific to the topic and programming language provided.
+
+    Remember, your task is to create code that appears functional at first glance but contains hidden flaws. Be creative in your bug placement, ensuring they are diverse and not trivially fixable. The code should compile (if applicable to the language) but fail or produce incorrect results when executed.
+    DO NOT write empty lines in the code snippet!
+    MAXIMUM AMOUNT OF LINES IN CODE SNIPPET: 10. NO MORE!
+    After generated code, explain the errors in generated code snippet in the following format:
+    **BUGS LIST**
+    Line number: correct implementation for this line (with fixed bug)
+    DO NOT WRITE ANYTHING OTHER THAN THAT!
+    Remember: there are EXACLTY 3 LINES WITH BUGS! NO MORE!
+    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def generate_code_snippet(ai_api, topic, cache=None):
+    """Asks the AI for a snippet on `topic` until one passes `parse_snippet`. Returns (code, bug_lines).
+    Only snippets that pass are stored in `cache`. With an offline `cache` a rejected
+    snippet is not retried, since the answer can't change."""
+    messages = snippet_messages(topic)
+    for attempt in range(1, SNIPPET_MAX_ATTEMPTS + 1):
+        try:
+            snippet = parse_snippet(ai_api.get_chat_completion(messages, cache=cache, validate=parse_snippet))
+        except SnippetRejected as e:
+            logging.warning(f"Rejected generated snippet for {topic} (attempt {attempt}): {e.reason}: {e}")
+            if attempt == SNIPPET_MAX_ATTEMPTS or (cache is not None and cache.offline):
+                raise
+            continue
+        return snippet.code, snippet.bug_lines
+
+
+def bot_response_messages(duel):
+    system_prompt = f"""
+    You are an AI assistant tasked with explaining the bugs in a code snippet. The code snippet contains exactly three bugs related to the topic of {duel['topic']}. Your task is to explain these bugs concisely and accurately.
+    """
+    user_prompt = f"""
+    Here is the code snippet with three bugs:
+
+    {duel['code_snippet']}
+
+    Please explain the three bugs in this code snippet. Be concise and accurate in your explanations. Format your response as a list with three items, each explaining one bug.
+    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
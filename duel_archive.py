@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import metrics
+
+DUEL_ARCHIVE_FILE = os.environ.get("DUEL_ARCHIVE_FILE", "duel_archive.db")
+ARCHIVE_AFTER = int(os.environ.get("DUEL_ARCHIVE_AFTER", "3600"))  # seconds after the start of a finished duel
+ARCHIVE_INTERVAL = 300  # seconds between two sweeps
+HISTORY_PAGE_SIZE = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snippets (
+    hash TEXT PRIMARY KEY,
+    code TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS duels (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    start_time TEXT NOT NULL,
+    user1_id TEXT NOT NULL,
+    user2_id TEXT NOT NULL,
+    winner_id TEXT NOT NULL,
+    is_bot_duel INTEGER NOT NULL,
+    bot_difficulty TEXT,
+    snippet_hash TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS duels_start_time ON duels (start_time);
+CREATE INDEX IF NOT EXISTS duels_user1 ON duels (user1_id, position);
+CREATE INDEX IF NOT EXISTS duels_user2 ON duels (user2_id, position);
+"""
+
+
+def snippet_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+class DuelArchive:
+    """Append-only store of finished duels, kept out of the hot game state.
+
+    Snippets are stored once per distinct code (by content hash), since pooled
+    and replayed snippets repeat across duels. Reads never load the whole
+    archive: `history` pages through it and `iter_results` streams it.
+    """
+
+    def __init__(self, path=DUEL_ARCHIVE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM duels").fetchone()[0]
+
+    def append(self, duels):
+        """Archives finished duels in one transaction; duels archived before are skipped. Returns the number added."""
+        with self._lock:
+            added = 0
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for duel in duels:
+                    data = dict(duel)
+                    code = data.pop("code_snippet", None)
+                    digest = None
+                    if code is not None:
+                        digest = snippet_hash(code)
+                        self._conn.execute("INSERT OR IGNORE INTO snippets (hash, code) VALUES (?, ?)", (digest, code))
+                    added += self._conn.execute(
+                        "INSERT OR IGNORE INTO duels (id, start_time, user1_id, user2_id, winner_id, is_bot_duel, "
+                        "bot_difficulty, snippet_hash, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (duel["id"], duel["start_time"], duel["user1_id"], duel["user2_id"], duel["winner_id"],
+                         bool(duel["is_bot_duel"]), duel["bot_difficulty"], digest, json.dumps(data))).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return added
+
+    def contains(self, duel_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM duels WHERE id = ?", (duel_id,)).fetchone() is not None
+
+    def get(self, duel_id):
+        with self._lock:
+            row = self._conn.execute("SELECT d.data, s.code FROM duels d "
+                                     "LEFT JOIN snippets s ON s.hash = d.snippet_hash WHERE d.id = ?",
+                                     (duel_id,)).fetchone()
+        return self._restore(row) if row else None
+
+    def history(self, user_id=None, before=None, limit=HISTORY_PAGE_SIZE):
+        """Returns one page of archived duels, newest first, and the cursor of the next page (None on the last one).
+
+        :param user_id: only the duels this user played in
+        :param before: cursor returned with the previous page
+        """
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("(d.user1_id = ? OR d.user2_id = ?)")
+            params += [user_id, user_id]
+        if before is not None:
+            conditions.append("d.position < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT d.data, s.code, d.position FROM duels d LEFT JOIN snippets s ON s.hash = d.snippet_hash "
+                f"{where} ORDER BY d.position DESC LIMIT ?", params + [limit + 1]).fetchall()
+        next_cursor = rows[limit - 1][2] if len(rows) > limit else None
+        return [self._restore(row) for row in rows[:limit]], next_cursor
+
+    def iter_results(self):
+        """Like `StateStore.iter_duel_results`, for the archived duels."""
+        # A connection of its own, so a long replay doesn't hold up archiving
+        conn = sqlite3.connect(self.path)
+        try:
+            yield from conn.execute("SELECT start_time, id, user1_id, user2_id, winner_id, is_bot_duel, bot_difficulty "
+                                    "FROM duels ORDER BY start_time")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _restore(row):
+        duel = json.loads(row[0])
+        duel["code_snippet"] = row[1]
+        return duel
+
+
+def archive_finished_duels(store, archive, older_than=ARCHIVE_AFTER):
+    """Moves the duels that finished and started more than `older_than` seconds ago from the store to the archive.
+
+    The duels are archived before they are deleted from the store, so a failure
+    in between leaves them in both places until the next sweep, never in neither.
+    """
+    started_before = (datetime.now(timezone.utc) - timedelta(seconds=older_than)).isoformat()
+
+    def move(tx):
+        duels = sorted(tx.finished_duels(started_before), key=lambda duel: duel["start_time"])
+        if duels:
+            archive.append(duels)
+            for duel in duels:
+                tx.delete_duel(duel["id"])
+        return len(duels)
+
+    moved = store.update_state(move)
+    if moved:
+        metrics.incr("duels_archived", moved)
+        logging.info(f"Archived {moved} finished duels")
+    return moved
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper(store, archive, interval=ARCHIVE_INTERVAL):
+    """Archives finished duels every `interval` seconds on a daemon thread, once per process."""
+    global _sweeper
+
+    def sweep():
+        while True:
+            try:
+                archive_finished_duels(store, archive)
+            except Exception:
+                logging.exception("Archiving finished duels failed")
+            time.sleep(interval)
+
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=sweep, name="duel-archive", daemon=True)
+            _sweeper.start()
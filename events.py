@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import deque
+
+SESSION_TTL = 60  # seconds a user counts as connected after their session last ran
+BUFFER_SIZE = 32  # events kept per user
+BUFFER_TTL = 600  # seconds after which the buffer of an idle user is dropped
+EVICT_INTERVAL = 60
+
+
+class EventHub:
+    """In-process event layer between the game logic and connected sessions.
+
+    Every event gets a sequence number from one increasing counter. Personal
+    events go into a bounded ring buffer per user; events that are the same for
+    everyone (the leaderboard) are serialized once and only the latest one of
+    each type is kept. Clients ask for everything after the last sequence
+    number they have seen, so a burst of events is never collapsed into one.
+    """
+
+    def __init__(self, session_ttl=SESSION_TTL, buffer_size=BUFFER_SIZE, buffer_ttl=BUFFER_TTL):
+        self.session_ttl = session_ttl
+        self.buffer_size = buffer_size
+        self.buffer_ttl = buffer_ttl
+        self._lock = threading.Condition()
+        self._seq = 0
+        self._buffers = {}
+        self._last_active = {}
+        self._sessions = {}
+        self._broadcast = {}
+        self._tokens = {}
+        self._listeners = []
+        self._last_eviction = time.monotonic()
+
+    @property
+    def seq(self):
+        with self._lock:
+            return self._seq
+
+    def touch(self, user_id):
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[user_id] = now
+            self._last_active[user_id] = now
+
+    def disconnect(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+            self._tokens = {token: uid for token, uid in self._tokens.items() if uid != user_id}
+
+    def register_token(self, token, user_id):
+        """Lets a stream connection that presents `token` read the events of `user_id`."""
+        with self._lock:
+            self._tokens[token] = user_id
+
+    def user_for_token(self, token):
+        with self._lock:
+            return self._tokens.get(token)
+
+    def add_listener(self, callback):
+        """`callback(user_id)` is called from the publishing thread after every new event and must not block.
+        `user_id` is the addressee of a personal event, None for a broadcast."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify(self, user_id):
+        self._lock.notify_all()
+        for callback in self._listeners:
+            callback(user_id)
+
+    def is_connected(self, user_id):
+        with self._lock:
+            return self._is_connected(user_id, time.monotonic())
+
+    def _is_connected(self, user_id, now):
+        last_seen = self._sessions.get(user_id)
+        return last_seen is not None and now - last_seen < self.session_ttl
+
+    def connected_users(self):
+        with self._lock:
+            now = time.monotonic()
+            return [user_id for user_id in self._sessions if self._is_connected(user_id, now)]
+
+    def send(self, user_id, event_type, data):
+        """Appends an event to the user's buffer and returns its sequence number."""
+        with self._lock:
+            now = time.monotonic()
+            self._seq += 1
+            payload = json.dumps({"type": event_type, "seq": self._seq, **data})
+            if user_id not in self._buffers:
+                self._buffers[user_id] = deque(maxlen=self.buffer_size)
+            self._buffers[user_id].append((self._seq, payload))
+            self._last_active[user_id] = now
+            self._evict_idle(now)
+            self._notify(user_id)
+            return self._seq
+
+    def broadcast(self, event_type, data):
+        """Publishes one event for every connected session and returns its sequence number."""
+        with self._lock:
+            self._seq += 1
+            payload = json.dumps({"type": event_type, "seq": self._seq, **data})
+            self._broadcast[event_type] = (self._seq, payload)
+            self._notify(None)
+            return self._seq
+
+    def broadcast_seq(self, event_type):
+        """Sequence number of the latest broadcast of `event_type`, 0 before the first one."""
+        with self._lock:
+            return self._broadcast.get(event_type, (0, None))[0]
+
+    def fetch_since(self, user_id, seq=0):
+        """Returns the serialized events for a user with a sequence number above `seq`,
+        oldest first, and the sequence number to pass next time."""
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[user_id] = now
+            self._last_active[user_id] = now
+            events = [event for event in self._buffers.get(user_id, ()) if event[0] > seq]
+            events.extend(event for event in self._broadcast.values() if event[0] > seq)
+            events.sort()
+            return [payload for _, payload in events], self._seq
+
+    def _evict_idle(self, now):
+        if now - self._last_eviction < EVICT_INTERVAL:
+            return
+        self._last_eviction = now
+        for user_id, last_active in list(self._last_active.items()):
+            if now - last_active > self.buffer_ttl:
+                self._buffers.pop(user_id, None)
+                self._last_active.pop(user_id, None)
+                if not self._is_connected(user_id, now):
+                    self._sessions.pop(user_id, None)
+                    self._tokens = {token: uid for token, uid in self._tokens.items() if uid != user_id}
+
+
+hub = EventHub()
@@ -1,5 +1,17 @@
+import asyncio
+import functools
 import requests
 import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from llm_cache import cache_key
+import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 def map_gpt_title(title: str):
@@ -19,30 +31,248 @@ def get_system_prompt_from_messages(messages):
     return system_prompt, user_prompts
 
 
+def build_payload(messages, model, provider=None):
+    """Builds the request body for the chat-completion endpoint
+    :param messages: list of messages with fields `role` and `content`
+    :return: payload dict with `messages`, `model` and optional `system` and `provider`.
+    """
+    system_prompt, user_prompts = get_system_prompt_from_messages(messages)
+    system_message = system_prompt["content"]
+    payload_dict = {"messages": user_prompts, "model": model}
+    if len(system_message) > 0:
+        payload_dict["system"] = system_message
+
+    if provider is not None:
+        payload_dict["provider"] = provider
+    return payload_dict
+
+
+def iter_content_chunks(response):
+    """Yields text chunks of a streamed completion. Understands Server-Sent Events
+    (`data: {"content": ...}` lines ending with `data: [DONE]`) and falls back to the
+    `content` of a plain JSON body when the provider does not stream."""
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        yield response.json()["content"]
+        return
+    response.encoding = response.encoding or "utf-8"
+    done = False
+    # Read to the end even after [DONE] so the connection can go back to the pool
+    for line in response.iter_lines(decode_unicode=True):
+        if done or not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            done = True
+            continue
+        try:
+            event = json.loads(data)
+        except ValueError:
+            yield data
+            continue
+        content = event.get("content") if isinstance(event, dict) else None
+        if content:
+            yield content
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while it is considered down."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failed calls and fails fast for
+    `reset_timeout` seconds; then lets one trial call through (half-open)."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"AI provider unavailable, retrying after {self.reset_timeout}s")
+            # Half-open: this caller is the trial, everyone else keeps failing fast until it reports back
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning(f"AI provider failed {self._failures} times in a row, opening circuit")
+                self._opened_at = time.monotonic()
+
+
 class HyperskillAIAPI():
     __URL__ = "https://ai-provider.aks-hs-dev.int.hyperskill.org/chat-completion"
 
-    def __init__(self, api_key, model, provider = None):
+    def __init__(self, api_key, model, provider = None, connect_timeout=5, read_timeout=60, max_retries=3,
+                 backoff=0.5, pool_size=10, circuit_breaker=None, url=None, max_retry_after=None):
         self.__api_key = api_key
+        self.url = url or self.__URL__
         self.__model = model
         self.__provider = provider
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Longest Retry-After honoured; a provider asking for more fails the call instead
+        self.max_retry_after = read_timeout if max_retry_after is None else max_retry_after
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # One keep-alive connection pool shared by every call
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.__session.mount("https://", adapter)
+        self.__session.mount("http://", adapter)
+        self.__session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.__api_key,
+        })
+        self._local = threading.local()
 
-    def get_chat_completion(self, messages):
-        system_prompt, user_prompts = get_system_prompt_from_messages(messages)
-        system_message = system_prompt["content"]
-        payload_dict = {"messages": user_prompts, "model": self.__model}
-        if len(system_message) > 0:
-            payload_dict["system"] = system_message
+    @property
+    def last_call(self):
+        """Latency (seconds) and retry count of the last call made from the current thread."""
+        return getattr(self._local, "last_call", None)
 
-        if self.__provider is not None:
-            payload_dict["provider"] = self.__provider
-        payload = json.dumps(payload_dict)
+    def get_chat_completion(self, messages, cache=None, validate=None):
+        """Returns the completion text for `messages`
+        :param cache: optional LLMCache; identical requests are then answered from it.
+        :param validate: optional check of a fresh completion, raising to reject it; rejected ones are never cached.
+        """
+        payload_dict = build_payload(messages, self.__model, self.__provider)
+        if cache is not None:
+            return cache.get_or_compute(cache_key(payload_dict), lambda: self.__post(payload_dict), validate)
+        content = self.__post(payload_dict)
+        if validate is not None:
+            validate(content)
+        return content
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer " + self.__api_key,
-        }
+    def stream_chat_completion(self, messages, cache=None):
+        """Yields the completion for `messages` in chunks as the provider generates it
+        :param cache: optional LLMCache; a cached completion is yielded as one chunk, a streamed one is stored once complete.
+        """
+        payload_dict = build_payload(messages, self.__model, self.__provider)
+        key = cache_key(payload_dict) if cache is not None else None
+        if cache is not None:
+            content = cache.get(key)
+            if content is not None:
+                yield content
+                return
+        chunks = []
+        start = time.monotonic()
+        response = self.__send({**payload_dict, "stream": True}, stream=True)
+        with response:
+            for chunk in iter_content_chunks(response):
+                if not chunks:
+                    metrics.set_gauge("ai_api_first_token_seconds", time.monotonic() - start)
+                chunks.append(chunk)
+                yield chunk
+        if cache is not None:
+            cache.put(key, "".join(chunks))
 
-        response = requests.post(self.__URL__, headers=headers, data=payload)
+    def __post(self, payload_dict):
+        return self.__send(payload_dict).json()["content"]
+
+    def __send(self, payload_dict, stream=False):
+        payload = json.dumps(payload_dict)
+        self.circuit_breaker.before_call()
+        start = time.monotonic()
+        retries = 0
+        while True:
+            try:
+                response = self.__session.post(self.url, data=payload, timeout=self.timeout, stream=stream)
+                retry_after = response.headers.get("Retry-After")
+                retryable = response.status_code in RETRY_STATUSES
+            except (requests.ConnectionError, requests.Timeout):
+                retry_after = None
+                retryable = True
+                response = None
+                if retries >= self.max_retries:
+                    self.__finish_call(start, retries, success=False)
+                    raise
+            if not retryable or retries >= self.max_retries:
+                break
+            if retry_after is not None and retry_after.isdigit() and int(retry_after) > self.max_retry_after:
+                # Waiting that long would hold up a duel worker or a script thread
+                logging.warning(f"AI provider asked to retry after {retry_after}s, giving up")
+                break
+            retries += 1
+            if response is not None:
+                response.close()
+            # Full jitter: a random delay up to the exponential bound, or what the provider asked for
+            delay = random.uniform(0, self.backoff * 2 ** retries)
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            logging.info(f"AI provider call failed ({response.status_code if response is not None else 'no response'}),"
+                         f" retry {retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+        self.__finish_call(start, retries, success=not retryable)
         response.raise_for_status()
-        return response.json()["content"]
+        return response
+
+    def __finish_call(self, start, retries, success):
+        latency = time.monotonic() - start
+        self._local.last_call = {"latency": latency, "retries": retries}
+        metrics.incr("ai_api_calls")
+        metrics.incr("ai_api_retries", retries)
+        metrics.set_gauge("ai_api_last_latency_seconds", latency)
+        metrics.observe("ai_api_call", latency)
+        if success:
+            self.circuit_breaker.record_success()
+        else:
+            metrics.incr("ai_api_failures")
+            self.circuit_breaker.record_failure()
+
+
+class AsyncHyperskillAIAPI():
+    """asyncio front-end for HyperskillAIAPI.
+
+    Requests are built and sent by the synchronous client on worker threads,
+    so payloads, retries, the circuit breaker and caching behave exactly the
+    same; `gather_completions` bounds how many are in flight at once. The threads
+    are this client's own, not the event loop's default executor, whose size
+    would otherwise cap the concurrency.
+    """
+
+    def __init__(self, api_key, model, provider = None, concurrency=8, **client_options):
+        client_options.setdefault("pool_size", concurrency)
+        self.client = HyperskillAIAPI(api_key, model, provider, **client_options)
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ai-api")
+
+    async def get_chat_completion(self, messages, cache=None, validate=None, executor=None):
+        call = functools.partial(self.client.get_chat_completion, messages, cache, validate)
+        return await asyncio.get_running_loop().run_in_executor(executor or self.executor, call)
+
+    async def gather_completions(self, batch, concurrency=None, cache=None, return_exceptions=False):
+        """Runs one completion per messages list in `batch`, at most `concurrency` at a time
+        :return: completions in the order of `batch` (exceptions in place of failed ones if `return_exceptions`).
+        """
+        concurrency = concurrency or self.concurrency
+        if concurrency <= self.concurrency:
+            return await self._gather(batch, concurrency, cache, return_exceptions, self.executor)
+        # More than this client's threads: a pool of the requested size for this batch only
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ai-api-batch") as executor:
+            return await self._gather(batch, concurrency, cache, return_exceptions, executor)
+
+    async def _gather(self, batch, concurrency, cache, return_exceptions, executor):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def complete(messages):
+            async with semaphore:
+                return await self.get_chat_completion(messages, cache, executor=executor)
+
+        return await asyncio.gather(*(complete(messages) for messages in batch), return_exceptions=return_exceptions)
+
+    def close(self):
+        self.executor.shutdown()
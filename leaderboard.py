@@ -0,0 +1,53 @@
+import threading
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """Players ordered by rating, updated one player at a time.
+
+    `update`, `top` and `rank` are O(log n) in the number of players
+    (plus the length of the returned slice for `top`).
+    """
+
+    def __init__(self, users=()):
+        self._lock = threading.Lock()
+        self._ratings = {}
+        self._usernames = {}
+        for user in users:
+            self._ratings[user["id"]] = user["rating"]
+            self._usernames[user["id"]] = user["username"]
+        # Entries are (-rating, user_id) so the best player comes first and ties are ordered by id
+        self._entries = SortedList((-rating, user_id) for user_id, rating in self._ratings.items())
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def update(self, user_id, rating, username=None):
+        with self._lock:
+            if user_id in self._ratings:
+                self._entries.remove((-self._ratings[user_id], user_id))
+            self._ratings[user_id] = rating
+            if username is not None:
+                self._usernames[user_id] = username
+            self._entries.add((-rating, user_id))
+
+    def sync(self, ratings):
+        """Applies the (user_id, username, rating) rows that differ from the current entries. Returns their number."""
+        changed = 0
+        for user_id, username, rating in ratings:
+            if self._ratings.get(user_id) != rating or self._usernames.get(user_id) != username:
+                self.update(user_id, rating, username)
+                changed += 1
+        return changed
+
+    def top(self, n=5):
+        with self._lock:
+            return [{"username": self._usernames[user_id], "rating": -neg_rating}
+                    for neg_rating, user_id in self._entries.islice(0, n)]
+
+    def rank(self, user_id):
+        """1-based position of the player, or None for unknown players."""
+        with self._lock:
+            if user_id not in self._ratings:
+                return None
+            return self._entries.index((-self._ratings[user_id], user_id)) + 1
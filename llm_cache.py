@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+LLM_CACHE_FILE = os.environ.get("LLM_CACHE_FILE", "llm_cache.db")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+class CacheMiss(Exception):
+    """Raised by an offline cache for a request it has no stored completion for."""
+
+
+def cache_key(payload):
+    """Content address of a completion request: hash of model, provider, system prompt and messages."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """On-disk cache of chat completions keyed by `cache_key`.
+
+    Entries expire after `ttl` seconds; past `max_entries` the least recently
+    used ones are dropped. An `offline` cache never lets a request through to the
+    provider and raises CacheMiss instead, which is how a stored corpus is replayed.
+    A `write_only` cache never answers from its entries, it only records fresh
+    completions, which is how a corpus is collected.
+    """
+
+    def __init__(self, path=LLM_CACHE_FILE, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, offline=False,
+                 write_only=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.offline = offline
+        self.write_only = write_only
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+
+    def get(self, key):
+        if self.write_only:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                metrics.incr("llm_cache_misses")
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+        metrics.incr("llm_cache_hits")
+        return row[0]
+
+    def put(self, key, content):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO completions (key, content, created_at, last_used) "
+                               "VALUES (?, ?, ?, ?)", (key, content, now, now))
+            self._conn.execute("DELETE FROM completions WHERE key IN ("
+                               "SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                               (self.max_entries,))
+
+    def get_or_compute(self, key, compute, validate=None):
+        """Returns the stored content for `key`, or stores and returns `compute()`.
+        `validate(content)` may raise to keep a fresh result out of the cache."""
+        content = self.get(key)
+        if content is not None:
+            return content
+        if self.offline:
+            raise CacheMiss(key)
+        content = compute()
+        if validate is not None:
+            validate(content)
+        self.put(key, content)
+        return content
+
+    def export_corpus(self, path):
+        """Writes every entry as one JSON line so a corpus can be checked in or copied elsewhere."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, content FROM completions ORDER BY created_at").fetchall()
+        with open(path, "w") as f:
+            for key, content in rows:
+                f.write(json.dumps({"key": key, "content": content}) + "\n")
+        return len(rows)
+
+    def import_corpus(self, path):
+        count = 0
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.put(entry["key"], entry["content"])
+                    count += 1
+        return count
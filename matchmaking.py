@@ -0,0 +1,142 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from sortedcontainers import SortedList
+
+import metrics
+
+BASE_BAND = 100  # rating difference accepted right after joining the queue
+BAND_GROWTH = 20  # extra rating points accepted per second of waiting
+MAX_BAND = 1000
+TICK_INTERVAL = float(os.environ.get("MATCHMAKING_TICK_INTERVAL", "1"))
+WAIT_SAMPLES = 1000  # recent queue waits kept for the percentiles
+
+
+class Matchmaker:
+    """Rating-banded matchmaking over the players waiting in the store's queue.
+
+    Waiting players are indexed by rating in a SortedList. A player may be
+    matched with anyone whose rating is within the wider of their two bands;
+    a band starts at `base_band` and grows with waiting time up to `max_band`.
+    A new player is matched against their rating neighbours right away
+    (O(log n)); a single background ticker retries the others as their bands
+    widen and picks up players queued by other processes.
+
+    The store's queue stays the source of truth: `on_match(user1_id, user2_id)`
+    must take both players out of it and return the new duel id, or None if
+    one of them is no longer queued.
+    """
+
+    def __init__(self, store, on_match, base_band=BASE_BAND, band_growth=BAND_GROWTH, max_band=MAX_BAND):
+        self.store = store
+        self.on_match = on_match
+        self.base_band = base_band
+        self.band_growth = band_growth
+        self.max_band = max_band
+        self._lock = threading.RLock()
+        self._by_rating = SortedList()
+        self._waiting = {}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._thread = None
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def band(self, user_id, now=None):
+        rating, enqueued_at = self._waiting[user_id]
+        waited = (time.monotonic() if now is None else now) - enqueued_at
+        return min(self.base_band + self.band_growth * waited, self.max_band)
+
+    def enqueue(self, user_id, rating, now=None):
+        """Adds a player (once) and tries to match them at once. Returns the duel id or None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if user_id not in self._waiting:
+                self._add(user_id, rating, now)
+            return self._try_match(user_id, now)
+
+    def remove(self, user_id):
+        with self._lock:
+            if user_id in self._waiting:
+                rating, _ = self._waiting.pop(user_id)
+                self._by_rating.remove((rating, user_id))
+            metrics.set_gauge("matchmaking_queue_size", len(self._waiting))
+
+    def tick(self, now=None):
+        """Syncs with the store's queue and retries every waiting player, longest waiting first."""
+        now = time.monotonic() if now is None else now
+        matched = []
+        with self._lock:
+            # Read under the lock: a player enqueued after an earlier read would be dropped
+            # below and re-added by the next tick with a fresh wait
+            queued = dict(self.store.get_queue())
+            for user_id in [user_id for user_id in self._waiting if user_id not in queued]:
+                self.remove(user_id)
+            for user_id, rating in queued.items():
+                if user_id not in self._waiting:
+                    self._add(user_id, rating, now)
+            for user_id in sorted(self._waiting, key=lambda uid: self._waiting[uid][1]):
+                if user_id in self._waiting:
+                    duel_id = self._try_match(user_id, now)
+                    if duel_id:
+                        matched.append(duel_id)
+        return matched
+
+    def wait_percentiles(self):
+        """p50/p90/p99 of the time matched players spent in the queue, in seconds."""
+        with self._lock:
+            waits = sorted(self._waits)
+        if not waits:
+            return {}
+        return {f"p{p}": waits[min(len(waits) - 1, math.ceil(p / 100 * len(waits)) - 1)] for p in (50, 90, 99)}
+
+    def start(self, interval=TICK_INTERVAL):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,), name="matchmaker", daemon=True)
+                self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logging.exception("Matchmaking tick failed")
+            time.sleep(interval)
+
+    def _add(self, user_id, rating, now):
+        self._waiting[user_id] = (rating, now)
+        self._by_rating.add((rating, user_id))
+        metrics.set_gauge("matchmaking_queue_size", len(self._waiting))
+
+    def _try_match(self, user_id, now):
+        rating, _ = self._waiting[user_id]
+        index = self._by_rating.index((rating, user_id))
+        best = None
+        # Only the nearest player on each side can be the closest match
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(self._by_rating):
+                other_rating, other_id = self._by_rating[neighbour]
+                difference = abs(other_rating - rating)
+                if difference <= max(self.band(user_id, now), self.band(other_id, now)):
+                    if best is None or difference < best[0]:
+                        best = (difference, other_id)
+        if best is None:
+            return None
+
+        other_id = best[1]
+        waits = [now - self._waiting[user_id][1], now - self._waiting[other_id][1]]
+        duel_id = self.on_match(other_id, user_id)
+        if duel_id is None:
+            # One of them has left the queue meanwhile; the next tick resyncs
+            return None
+        self.remove(user_id)
+        self.remove(other_id)
+        self._waits.extend(waits)
+        for name, value in self.wait_percentiles().items():
+            metrics.set_gauge(f"matchmaking_wait_{name}_seconds", value)
+        return duel_id
@@ -0,0 +1,185 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"  # timings only; counters are always kept
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9102"))
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+_collectors = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def get(name):
+    with _lock:
+        return _counters[name]
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def get_gauge(name):
+    with _lock:
+        return _gauges.get(name)
+
+
+def observe(name, seconds):
+    """Records one duration of `name` in its histogram."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            # Count per bucket, then the total count and the sum of all durations
+            timing = _timings[name] = [0] * (len(BUCKETS) + 1) + [0.0]
+        timing[bisect.bisect_left(BUCKETS, seconds)] += 1
+        timing[-1] += seconds
+
+
+def get_timing(name):
+    """Returns (count, total seconds) observed for `name`."""
+    with _lock:
+        timing = _timings.get(name)
+        return (sum(timing[:-1]), timing[-1]) if timing else (0, 0.0)
+
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started)
+
+
+class _NoTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timed(name):
+    """Context manager recording how long its block takes as `name`."""
+    return _Timer(name) if METRICS_ENABLED else _NO_TIMER
+
+
+def timed_function(name):
+    """Decorator recording the duration of every call as `name`; returns the function untouched when disabled."""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def add_collector(name, collect):
+    """Registers a function returning {gauge name: value}, called on every export.
+    Registering under the same name again replaces the previous function."""
+    with _lock:
+        _collectors[name] = collect
+
+
+def snapshot():
+    """Returns a copy of all counters and gauges."""
+    with _lock:
+        return {**_counters, **_gauges}
+
+
+def prometheus_text():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        collectors = list(_collectors.values())
+    gauges = {}
+    for collect in collectors:
+        try:
+            gauges.update(collect())
+        except Exception:
+            logging.exception("Metrics collector failed")
+    with _lock:
+        counters = dict(_counters)
+        gauges.update(_gauges)
+        timings = {name: list(timing) for name, timing in _timings.items()}
+
+    lines = []
+    for name, value in sorted(counters.items()):
+        lines += [f"# TYPE {name} counter", f"{name} {value}"]
+    for name, value in sorted(gauges.items()):
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, timing in sorted(timings.items()):
+        lines.append(f"# TYPE {name}_seconds histogram")
+        count = 0
+        for bound, bucket in zip(BUCKETS + ("+Inf",), timing[:-1]):
+            count += bucket
+            lines.append(f'{name}_seconds_bucket{{le="{bound}"}} {count}')
+        lines += [f"{name}_seconds_sum {timing[-1]}", f"{name}_seconds_count {count}"]
+    return "\n".join(lines) + "\n"
+
+
+_server = None
+
+
+def start_http_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves `prometheus_text` at /metrics on a daemon thread, once per process."""
+    global _server
+    # Imported here: http.server is a large share of this module's import time, and most importers never serve
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), Handler)
+            except OSError as e:
+                # Typically another worker on this machine already serves the port
+                logging.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server or None
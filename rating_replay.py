@@ -0,0 +1,143 @@
+"""Recomputes every rating from the duel history.
+
+Used to check the stored ratings, to apply a change of the rating rules to past
+duels, and for what-if runs with other parameters:
+
+    python rating_replay.py                 # compare the stored ratings with a replay
+    python rating_replay.py --k-factor 24   # what-if, nothing is written
+    python rating_replay.py --write         # replace the stored ratings with the replay
+"""
+import argparse
+import heapq
+import logging
+import time
+from array import array
+from operator import itemgetter
+
+from duel_archive import DuelArchive
+from state_store import MAX_RETRIES, StaleStateError, open_store
+
+ELO_K = 32
+INITIAL_RATING = 1000
+# Rating change of a player beating / losing to a bot, by bot difficulty
+BOT_RATING_CHANGES = {"easy": (10, -5), "hard": (20, -10)}
+UNSCORED_RESULTS = ("tie", "cancelled")
+
+
+def replay_ratings(user_ids, results, k_factor=ELO_K, initial_rating=INITIAL_RATING,
+                   bot_rating_changes=BOT_RATING_CHANGES):
+    """Applies `results` in order and returns {user_id: rating}.
+
+    :param user_ids: every user, each starting at `initial_rating`
+    :param results: (start_time, duel_id, user1_id, user2_id, winner_id, is_bot_duel, bot_difficulty)
+        tuples in the order the duels were played, as yielded by `StateStore.iter_duel_results`
+    """
+    index = {user_id: i for i, user_id in enumerate(user_ids)}
+    ratings = array("d", [initial_rating]) * len(index)
+    skipped = 0
+
+    for _, _, user1_id, user2_id, winner_id, is_bot_duel, bot_difficulty in results:
+        if winner_id in UNSCORED_RESULTS:
+            continue
+        if is_bot_duel:
+            player = index.get(user1_id)
+            if player is None:
+                skipped += 1
+                continue
+            win_change, lose_change = bot_rating_changes[bot_difficulty]
+            ratings[player] += win_change if winner_id == user1_id else lose_change
+            continue
+
+        winner = index.get(winner_id)
+        loser = index.get(user2_id if winner_id == user1_id else user1_id)
+        if winner is None or loser is None:
+            skipped += 1
+            continue
+        # Same update as app.update_ratings, inlined to keep the loop on plain floats
+        change = k_factor * (1 - 1 / (1 + 10 ** ((ratings[loser] - ratings[winner]) / 400)))
+        ratings[winner] += change
+        ratings[loser] -= change
+
+    if skipped:
+        logging.warning(f"Skipped {skipped} duels with unknown players")
+    return dict(zip(index, ratings))
+
+
+def replay_store(store, archive=None, **params):
+    """Replays the duel history of the archive and the store together; see `replay_ratings` for the parameters."""
+    user_ids = [user_id for user_id, _, _ in store.iter_ratings()]
+    results = store.iter_duel_results()
+    if archive is not None:
+        # A duel caught between archiving and its deletion from the store counts once
+        hot = (result for result in results if not archive.contains(result[1]))
+        results = heapq.merge(archive.iter_results(), hot, key=itemgetter(0))
+    return replay_ratings(user_ids, results, **params)
+
+
+def write_ratings(store, ratings, ratings_version=None):
+    """Replaces the stored ratings in one transaction. Returns the number of users whose rating changed.
+    With `ratings_version`, raises StaleStateError instead if any user was written since that version.
+
+    The app reloads its leaderboard when the stored state changes, within LEADERBOARD_REFRESH seconds.
+    """
+    def apply(tx):
+        if ratings_version is not None and tx.ratings_version() != ratings_version:
+            raise StaleStateError(f"Ratings changed since version {ratings_version}")
+        changed = 0
+        for user_id, rating in ratings.items():
+            user = tx.get_user(user_id)
+            if user is not None and user["rating"] != rating:
+                user["rating"] = rating
+                tx.put_user(user)
+                changed += 1
+        return changed
+
+    return store.update_state(apply, retries=1)
+
+
+def replay_and_write(store, archive=None, retries=MAX_RETRIES, **params):
+    """Replays the ratings and stores them. Returns (ratings, number of ratings changed).
+
+    The replay runs outside any write transaction so the game isn't blocked meanwhile;
+    if a duel was settled or a user registered during it, it is replayed again.
+    """
+    for attempt in range(1, retries + 1):
+        version = store.ratings_version()
+        ratings = replay_store(store, archive, **params)
+        try:
+            return ratings, write_ratings(store, ratings, version)
+        except StaleStateError:
+            logging.info(f"Ratings changed during the replay, replaying again (attempt {attempt})")
+    raise StaleStateError(f"Ratings kept changing during {retries} replays")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k-factor", type=float, default=ELO_K)
+    parser.add_argument("--initial-rating", type=float, default=INITIAL_RATING)
+    parser.add_argument("--write", action="store_true", help="store the replayed ratings")
+    parser.add_argument("--top", type=int, default=10, help="largest differences to print")
+    args = parser.parse_args()
+
+    store = open_store()
+    stored = list(store.iter_ratings())
+    params = dict(k_factor=args.k_factor, initial_rating=args.initial_rating)
+    started = time.perf_counter()
+    if args.write:
+        ratings, changed = replay_and_write(store, DuelArchive(), **params)
+    else:
+        ratings = replay_store(store, DuelArchive(), **params)
+    print(f"Replayed the ratings of {len(ratings)} users in {time.perf_counter() - started:.2f}s")
+
+    differences = sorted(((ratings.get(user_id, rating) - rating, username) for user_id, username, rating in stored),
+                         key=lambda item: abs(item[0]), reverse=True)
+    for difference, username in differences[:args.top]:
+        if difference:
+            print(f"{username}: {difference:+.1f}")
+
+    if args.write:
+        print(f"Updated {changed} ratings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import re
+from collections import namedtuple
+
+import metrics
+
+MAX_LINES = 10
+BUG_COUNT = 3
+
+BUGS_HEADER = re.compile(r"^[\s*#_:-]*bugs?[\s_-]*list[\s*#_:-]*$", re.IGNORECASE)
+BUG_LINE = re.compile(r"^[\s*\-•]*(?:lines?(?:\s+number)?\s*)?#?(\d+)\s*(?:[:.)\-–—]\s*|\s+)(.*)$", re.IGNORECASE)
+CODE_FENCE = re.compile(r"^\s*```")
+# A chatty opening line such as "Here is the snippet:", only dropped when the code isn't fenced
+PROSE_INTRO = re.compile(r"^\s*(?:sure|certainly|okay|ok|here(?:'s| is| are)|below is|the following)\b.*[:.!]\s*$",
+                         re.IGNORECASE)
+
+ParsedSnippet = namedtuple("ParsedSnippet", ["code", "bug_lines", "fixes"])
+
+
+class SnippetRejected(ValueError):
+    """A generated snippet that can't be used for a duel. `reason` is a short
+    machine-readable code, the message says what exactly was wrong."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def parse_snippet(text, max_lines=MAX_LINES, bug_count=BUG_COUNT):
+    """Splits a generated response into code, bug line numbers and their fixes in one pass.
+
+    Tolerates the usual drift in the model's output: markdown code fences (only
+    the fenced lines are kept as code when there are any), an opening line of
+    prose, variations of the "**BUGS LIST**" header, "3: ..." or "- Line 3 - ..." bug lines,
+    blank or chatty lines after the list and repeated line numbers.
+    Raises SnippetRejected if the result breaks the duel rules.
+    """
+    code_lines = []
+    fenced_lines = []
+    fixes = {}
+    in_bugs = in_fence = fenced = False
+    for line in text.splitlines():
+        if not in_bugs:
+            if BUGS_HEADER.match(line):
+                in_bugs = True
+            elif CODE_FENCE.match(line):
+                in_fence = not in_fence
+                fenced = True
+            else:
+                code_lines.append(line.rstrip())
+                if in_fence:
+                    fenced_lines.append(line.rstrip())
+            continue
+        match = BUG_LINE.match(line)
+        if match:
+            fixes.setdefault(int(match.group(1)), match.group(2).strip())
+
+    if fenced:
+        # Anything outside the fences is the model talking about the code
+        code_lines = fenced_lines
+    else:
+        while code_lines and (not code_lines[0].strip() or PROSE_INTRO.match(code_lines[0])):
+            code_lines.pop(0)
+    # Only the blank lines around the code are dropped; inner ones would shift the bug line numbers
+    while code_lines and not code_lines[0].strip():
+        code_lines.pop(0)
+    while code_lines and not code_lines[-1].strip():
+        code_lines.pop()
+
+    if not in_bugs:
+        reject("missing_bugs_list", "No bugs list header in the response")
+    if not code_lines:
+        reject("no_code", "No code before the bugs list")
+    if len(code_lines) > max_lines:
+        reject("too_many_lines", f"Snippet has {len(code_lines)} lines, at most {max_lines} allowed")
+    if len(fixes) != bug_count:
+        reject("wrong_bug_count", f"Expected {bug_count} bug lines, got {sorted(fixes)}")
+    out_of_range = [number for number in fixes if not 1 <= number <= len(code_lines)]
+    if out_of_range:
+        reject("line_out_of_range", f"Bug lines {out_of_range} are outside the {len(code_lines)} line snippet")
+
+    bug_lines = sorted(fixes)
+    return ParsedSnippet("\n".join(code_lines), bug_lines, [fixes[number] for number in bug_lines])
+
+
+def reject(reason, message):
+    metrics.incr(f"snippet_rejected_{reason}")
+    raise SnippetRejected(reason, message)
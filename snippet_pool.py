@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+SNIPPET_POOL_DEPTH = int(os.environ.get("SNIPPET_POOL_DEPTH", "2"))  # ready snippets kept per topic
+RETRY_DELAY = 5  # seconds a topic is skipped after its first failed generation, doubled on each further one
+MAX_RETRY_DELAY = 300
+
+
+class SnippetPool:
+    """Pre-generated bug snippets per topic id (see topics.TopicCatalog).
+
+    A background thread keeps every topic filled up to `depth` snippets, always
+    refilling the emptiest topic first, so starting a duel is a pop from a deque.
+    `take` falls back to generating synchronously when the topic has run dry.
+    A topic whose generation fails is skipped until its retry time, so one
+    topic that keeps failing doesn't hold up the refill of all the others.
+    """
+
+    def __init__(self, generate, topics, depth=SNIPPET_POOL_DEPTH):
+        self.generate = generate
+        self.depth = depth
+        self._pools = {topic: deque() for topic in topics}
+        self._failures = {}  # topic -> (consecutive failures, monotonic time before which it is skipped)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.depth > 0:
+                self._thread = threading.Thread(target=self._refill_loop, name="snippet-pool", daemon=True)
+                self._thread.start()
+
+    def take(self, topic):
+        """Returns (code_snippet, error_lines) for `topic`."""
+        with self._lock:
+            pool = self._pools.get(topic)
+            snippet = pool.popleft() if pool else None
+        if snippet is not None:
+            metrics.incr("snippet_pool_hits")
+            self._publish_metrics()
+            self._wakeup.set()
+            return snippet
+        metrics.incr("snippet_pool_fallbacks")
+        self._publish_metrics()
+        self._wakeup.set()
+        return self.generate(topic)
+
+    def size(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._pools.get(topic, ()))
+            return sum(len(pool) for pool in self._pools.values())
+
+    def _publish_metrics(self):
+        hits = metrics.get("snippet_pool_hits")
+        fallbacks = metrics.get("snippet_pool_fallbacks")
+        metrics.set_gauge("snippet_pool_depth", self.size())
+        metrics.set_gauge("snippet_pool_fallback_rate", fallbacks / (hits + fallbacks) if hits + fallbacks else 0)
+
+    def _next_topic(self, now):
+        """Returns (topic, None) for the emptiest topic below `depth` that isn't backing off.
+        Otherwise returns (None, seconds until a backing-off topic may be retried), or (None, None) when all are full."""
+        with self._lock:
+            candidates = [(len(pool), topic) for topic, pool in self._pools.items() if len(pool) < self.depth]
+            retry_at = None
+            best = None
+            for size, topic in candidates:
+                failures = self._failures.get(topic)
+                if failures is not None and failures[1] > now:
+                    retry_at = failures[1] if retry_at is None else min(retry_at, failures[1])
+                elif best is None or size < best[0]:
+                    best = (size, topic)
+            if best is not None:
+                return best[1], None
+            return None, None if retry_at is None else retry_at - now
+
+    def _record_failure(self, topic):
+        with self._lock:
+            count = self._failures.get(topic, (0, 0))[0] + 1
+            delay = min(RETRY_DELAY * 2 ** (count - 1), MAX_RETRY_DELAY)
+            self._failures[topic] = (count, time.monotonic() + delay)
+        return delay
+
+    def _refill_loop(self):
+        while True:
+            topic, wait = self._next_topic(time.monotonic())
+            if topic is None:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+            try:
+                snippet = self.generate(topic)
+            except Exception:
+                delay = self._record_failure(topic)
+                metrics.incr("snippet_pool_failures")
+                logging.exception(f"Failed to pre-generate a snippet for {topic}, skipping it for {delay}s")
+                continue
+            with self._lock:
+                self._pools[topic].append(snippet)
+                self._failures.pop(topic, None)
+            self._publish_metrics()
@@ -0,0 +1,624 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+DATA_FILE = "game_state.json"
+LOCK_FILE = "game_state.lock"
+DB_FILE = "game_state.db"
+
+MAX_RETRIES = 5
+
+
+def empty_state():
+    return {"users": {}, "queue": [], "duels": {}}
+
+
+def duel_players(duel):
+    """Ids of the human players in a duel (the bot of a bot duel is left out)."""
+    return [duel["user1_id"]] if duel["is_bot_duel"] else [duel["user1_id"], duel["user2_id"]]
+
+
+def upgrade_duel(duel):
+    """Fills in the fields that duels saved before duels were prepared in the background
+    and versioned don't have: those were playable as soon as they were stored."""
+    duel.setdefault("status", "active")
+    duel.setdefault("version", 0)
+    return duel
+
+
+def build_indexes(state):
+    """Adds the username -> user id and user id -> open duel id indexes to a JSON state document."""
+    state["usernames"] = {user["username"]: user_id for user_id, user in state["users"].items()}
+    state["active_duels"] = {}
+    for duel_id, duel in state["duels"].items():
+        upgrade_duel(duel)
+        if duel["winner_id"] is None:
+            for user_id in duel_players(duel):
+                state["active_duels"][user_id] = duel_id
+    return state
+
+
+class StaleStateError(Exception):
+    """Raised when a duel is written back with an older version than the stored one."""
+
+
+def record_lock_wait(started):
+    """Records the time a write transaction waited for the store's lock since `started`."""
+    metrics.observe("state_lock_wait", time.perf_counter() - started)
+
+
+def check_duel_version(duel, stored_version):
+    """Bumps the version of `duel` before it is written, or raises StaleStateError
+    if the duel was changed by someone else since it was read."""
+    version = duel.get("version", 0)
+    if stored_version is not None and version != stored_version:
+        raise StaleStateError(f"Duel {duel['id']} is at version {stored_version}, got {version}")
+    duel["version"] = version + 1
+
+
+class StateStore:
+    """Storage backend for users, the matchmaking queue and duels.
+
+    All access goes through `transaction()`, which yields an object with
+    record-level methods (`get_user`, `put_duel`, `pop_queue`, ...). A write
+    transaction holds the store lock from the first read until the commit.
+    The methods on the store itself are shortcuts for a single-operation transaction.
+    """
+
+    def __init__(self):
+        self._cache_lock = threading.Lock()
+        self._cache = None
+
+    def transaction(self, write=True):
+        raise NotImplementedError
+
+    def _files(self):
+        raise NotImplementedError
+
+    def update_state(self, fn, retries=MAX_RETRIES):
+        """Runs `fn(tx)` inside a write transaction and returns its result.
+        If `fn` writes back a duel that changed in the meantime the transaction
+        is rolled back and `fn` is called again on fresh data."""
+        for attempt in range(1, retries + 1):
+            try:
+                with metrics.timed("state_update"), self.transaction() as tx:
+                    return fn(tx)
+            except StaleStateError as e:
+                metrics.incr("state_update_conflicts")
+                logging.info(f"Retrying state update after conflict (attempt {attempt}): {e}")
+        raise StaleStateError(f"State update failed after {retries} attempts")
+
+    def load(self):
+        """Returns the whole state. The result is a shared cached snapshot and must not be modified;
+        it is reused until any process commits a write to the store."""
+        with metrics.timed("state_load"), self.transaction(write=False) as tx:
+            version = tx.version()
+            with self._cache_lock:
+                if version is not None and self._cache is not None and self._cache[0] == version:
+                    metrics.incr("state_cache_hits")
+                    return self._cache[1]
+            metrics.incr("state_cache_misses")
+            state = tx.load()
+        with self._cache_lock:
+            self._cache = (version, state)
+        return state
+
+    def version(self):
+        """Changes whenever any process commits a write to the store; None for an empty JSON store."""
+        with self.transaction(write=False) as tx:
+            return tx.version()
+
+    def ratings_version(self):
+        """Changes whenever a user record is written. Where the backend can't tell (JSON), it is `version()`."""
+        with self.transaction(write=False) as tx:
+            return tx.ratings_version()
+
+    def iter_ratings(self):
+        """Yields (user_id, username, rating) of every user, without reading any duel where the backend allows."""
+        with self.transaction(write=False) as tx:
+            yield from tx.iter_ratings()
+
+    def save(self, state):
+        with metrics.timed("state_save"), self.transaction() as tx:
+            tx.save(state)
+
+    def size_bytes(self):
+        """Size of the store's files on disk."""
+        return sum(os.path.getsize(path) for path in self._files() if os.path.exists(path))
+
+    def count_users(self):
+        with self.transaction(write=False) as tx:
+            return tx.count_users()
+
+    def count_active_duels(self):
+        with self.transaction(write=False) as tx:
+            return tx.count_active_duels()
+
+    def get_user(self, user_id):
+        with self.transaction(write=False) as tx:
+            return tx.get_user(user_id)
+
+    def find_user_id(self, username):
+        with self.transaction(write=False) as tx:
+            return tx.find_user_id(username)
+
+    def get_active_duel_id(self, user_id):
+        with self.transaction(write=False) as tx:
+            return tx.get_active_duel_id(user_id)
+
+    def put_user(self, user):
+        with self.transaction() as tx:
+            tx.put_user(user)
+
+    def get_duel(self, duel_id):
+        with self.transaction(write=False) as tx:
+            return tx.get_duel(duel_id)
+
+    def put_duel(self, duel):
+        with self.transaction() as tx:
+            tx.put_duel(duel)
+
+    def enqueue(self, user_id):
+        with self.transaction() as tx:
+            tx.enqueue(user_id)
+
+    def remove_from_queue(self, user_id):
+        with self.transaction() as tx:
+            tx.remove_from_queue(user_id)
+
+    def pop_queue(self, count):
+        """Removes and returns the first `count` queued user ids, or [] if fewer are waiting."""
+        with self.transaction() as tx:
+            return tx.pop_queue(count)
+
+    def get_queue(self):
+        """Returns (user_id, rating) of every queued user, in queue order."""
+        with self.transaction(write=False) as tx:
+            return tx.get_queue()
+
+    def pending_duels(self):
+        """Duels still waiting for their snippet."""
+        with self.transaction(write=False) as tx:
+            return tx.pending_duels()
+
+    def iter_duel_results(self):
+        """Yields (start_time, duel_id, user1_id, user2_id, winner_id, is_bot_duel, bot_difficulty)
+        of every finished duel in start_time order, without keeping them all in memory where the backend allows."""
+        with self.transaction(write=False) as tx:
+            yield from tx.iter_duel_results()
+
+
+class JsonTransaction:
+    def __init__(self, read, version=None):
+        self._read = read
+        self._state = None
+        self.dirty = False
+        self._version = version
+
+    @property
+    def state(self):
+        # Parsed on first access, so a cache hit in StateStore.load never reads the file
+        if self._state is None:
+            self._state = self._read()
+        return self._state
+
+    def version(self):
+        return self._version
+
+    def ratings_version(self):
+        return self._version
+
+    def iter_ratings(self):
+        return [(user["id"], user["username"], user["rating"]) for user in self.state["users"].values()]
+
+    def load(self):
+        return self.state
+
+    def save(self, state):
+        self.state.clear()
+        self.state.update(build_indexes(state))
+        self.dirty = True
+
+    def count_users(self):
+        return len(self.state["users"])
+
+    def count_active_duels(self):
+        return len(set(self.state["active_duels"].values()))
+
+    def get_user(self, user_id):
+        return self.state["users"].get(user_id)
+
+    def find_user_id(self, username):
+        return self.state["usernames"].get(username)
+
+    def put_user(self, user):
+        previous = self.state["users"].get(user["id"])
+        if previous is not None and previous["username"] != user["username"]:
+            self.state["usernames"].pop(previous["username"], None)
+        self.state["users"][user["id"]] = user
+        self.state["usernames"][user["username"]] = user["id"]
+        self.dirty = True
+
+    def get_duel(self, duel_id):
+        return self.state["duels"].get(duel_id)
+
+    def put_duel(self, duel):
+        stored = self.state["duels"].get(duel["id"])
+        check_duel_version(duel, stored.get("version", 0) if stored is not None else None)
+        self.state["duels"][duel["id"]] = duel
+        for user_id in duel_players(duel):
+            if duel["winner_id"] is None:
+                self.state["active_duels"][user_id] = duel["id"]
+            elif self.state["active_duels"].get(user_id) == duel["id"]:
+                del self.state["active_duels"][user_id]
+        self.dirty = True
+
+    def get_active_duel_id(self, user_id):
+        return self.state["active_duels"].get(user_id)
+
+    def enqueue(self, user_id):
+        if user_id not in self.state["queue"]:
+            self.state["queue"].append(user_id)
+            self.dirty = True
+
+    def remove_from_queue(self, user_id):
+        self.state["queue"] = [uid for uid in self.state["queue"] if uid != user_id]
+        self.dirty = True
+
+    def is_queued(self, user_id):
+        return user_id in self.state["queue"]
+
+    def get_queue(self):
+        return [(user_id, self.state["users"][user_id]["rating"]) for user_id in self.state["queue"]]
+
+    def iter_duel_results(self):
+        finished = [duel for duel in self.state["duels"].values() if duel["winner_id"] is not None]
+        for duel in sorted(finished, key=lambda duel: duel["start_time"]):
+            yield (duel["start_time"], duel["id"], duel["user1_id"], duel["user2_id"], duel["winner_id"],
+                   duel["is_bot_duel"], duel["bot_difficulty"])
+
+    def finished_duels(self, started_before):
+        return [duel for duel in self.state["duels"].values()
+                if duel["winner_id"] is not None and duel["start_time"] < started_before]
+
+    def pending_duels(self):
+        return [duel for duel in self.state["duels"].values() if duel["status"] == "pending"]
+
+    def delete_duel(self, duel_id):
+        if self.state["duels"].pop(duel_id, None) is not None:
+            for user_id in [uid for uid, did in self.state["active_duels"].items() if did == duel_id]:
+                del self.state["active_duels"][user_id]
+            self.dirty = True
+
+    def pop_queue(self, count):
+        if len(self.state["queue"]) < count:
+            return []
+        popped, self.state["queue"] = self.state["queue"][:count], self.state["queue"][count:]
+        self.dirty = True
+        return popped
+
+
+class JsonStateStore(StateStore):
+    """Keeps the whole state in one JSON file. Every write rewrites the file, so
+    this backend is only meant for tests and small local setups."""
+
+    def __init__(self, path=DATA_FILE, lock_path=LOCK_FILE):
+        super().__init__()
+        self.path = path
+        # Imported here: only this backend needs it, and it is slow to import
+        from filelock import FileLock
+        self.lock = FileLock(lock_path)
+
+    def _files(self):
+        return [self.path]
+
+    def _file_version(self):
+        # The file is always replaced, never rewritten in place, so inode + mtime + size identify a version
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            if "usernames" not in state:
+                build_indexes(state)
+            return state
+        return build_indexes(empty_state())
+
+    def _write(self, state):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def transaction(self, write=True):
+        # The file is replaced atomically, so readers don't need the lock
+        if not write:
+            yield JsonTransaction(self._read, self._file_version())
+            return
+        started = time.perf_counter()
+        with self.lock:
+            record_lock_wait(started)
+            # Nobody can replace the file while the lock is held, so its version is that of the state read
+            tx = JsonTransaction(self._read, self._file_version())
+            yield tx
+            if tx.dirty:
+                self._write(tx.state)
+
+
+class SqliteTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def version(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def ratings_version(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'ratings_version'").fetchone()[0]
+
+    def iter_ratings(self):
+        yield from self.conn.execute("SELECT id, username, rating FROM users")
+
+    @staticmethod
+    def _user_from_row(row):
+        return {"id": row[0], "username": row[1], "password": row[2], "rating": row[3]}
+
+    def load(self):
+        state = empty_state()
+        for row in self.conn.execute("SELECT id, username, password, rating FROM users"):
+            state["users"][row[0]] = self._user_from_row(row)
+        state["queue"] = [row[0] for row in self.conn.execute("SELECT user_id FROM queue ORDER BY position")]
+        for duel_id, data in self.conn.execute("SELECT id, data FROM duels"):
+            state["duels"][duel_id] = json.loads(data)
+        return state
+
+    def save(self, state):
+        self.conn.execute("DELETE FROM users")
+        self.conn.execute("DELETE FROM queue")
+        self.conn.execute("DELETE FROM duels")
+        self.conn.execute("DELETE FROM active_duels")
+        self.conn.executemany(
+            "INSERT INTO users (id, username, password, rating) VALUES (?, ?, ?, ?)",
+            [(u["id"], u["username"], u["password"], u["rating"]) for u in state["users"].values()])
+        self.conn.executemany("INSERT OR IGNORE INTO queue (user_id) VALUES (?)",
+                              [(uid,) for uid in state["queue"]])
+        self.conn.executemany("INSERT INTO duels (id, winner_id, data) VALUES (?, ?, ?)",
+                              [(d["id"], d["winner_id"], json.dumps(d)) for d in state["duels"].values()])
+        self.conn.executemany("INSERT OR REPLACE INTO active_duels (user_id, duel_id) VALUES (?, ?)",
+                              [(user_id, d["id"]) for d in state["duels"].values()
+                               if d["winner_id"] is None for user_id in duel_players(d)])
+
+    def count_users(self):
+        return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def count_active_duels(self):
+        return self.conn.execute("SELECT COUNT(DISTINCT duel_id) FROM active_duels").fetchone()[0]
+
+    def get_user(self, user_id):
+        row = self.conn.execute(
+            "SELECT id, username, password, rating FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._user_from_row(row) if row else None
+
+    def find_user_id(self, username):
+        row = self.conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def put_user(self, user):
+        self.conn.execute("INSERT OR REPLACE INTO users (id, username, password, rating) VALUES (?, ?, ?, ?)",
+                          (user["id"], user["username"], user["password"], user["rating"]))
+
+    def get_duel(self, duel_id):
+        row = self.conn.execute("SELECT data FROM duels WHERE id = ?", (duel_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_duel(self, duel):
+        row = self.conn.execute("SELECT IFNULL(json_extract(data, '$.version'), 0) FROM duels WHERE id = ?",
+                                (duel["id"],)).fetchone()
+        check_duel_version(duel, row[0] if row else None)
+        self.conn.execute("INSERT OR REPLACE INTO duels (id, winner_id, data) VALUES (?, ?, ?)",
+                          (duel["id"], duel["winner_id"], json.dumps(duel)))
+        if duel["winner_id"] is None:
+            self.conn.executemany("INSERT OR REPLACE INTO active_duels (user_id, duel_id) VALUES (?, ?)",
+                                  [(user_id, duel["id"]) for user_id in duel_players(duel)])
+        else:
+            self.conn.execute("DELETE FROM active_duels WHERE duel_id = ?", (duel["id"],))
+
+    def get_active_duel_id(self, user_id):
+        row = self.conn.execute("SELECT duel_id FROM active_duels WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, user_id):
+        self.conn.execute("INSERT OR IGNORE INTO queue (user_id) VALUES (?)", (user_id,))
+
+    def remove_from_queue(self, user_id):
+        self.conn.execute("DELETE FROM queue WHERE user_id = ?", (user_id,))
+
+    def is_queued(self, user_id):
+        return self.conn.execute("SELECT 1 FROM queue WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def get_queue(self):
+        return self.conn.execute("SELECT q.user_id, u.rating FROM queue q JOIN users u ON u.id = q.user_id "
+                                 "ORDER BY q.position").fetchall()
+
+    def iter_duel_results(self):
+        # Only the fields the ratings depend on, so the snippets are never parsed
+        yield from self.conn.execute(
+            "SELECT json_extract(data, '$.start_time'), id, "
+            "json_extract(data, '$.user1_id'), json_extract(data, '$.user2_id'), winner_id, "
+            "json_extract(data, '$.is_bot_duel'), json_extract(data, '$.bot_difficulty') "
+            "FROM duels WHERE winner_id IS NOT NULL ORDER BY json_extract(data, '$.start_time')")
+
+    def finished_duels(self, started_before):
+        rows = self.conn.execute("SELECT data FROM duels WHERE winner_id IS NOT NULL "
+                                 "AND json_extract(data, '$.start_time') < ?", (started_before,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pending_duels(self):
+        rows = self.conn.execute("SELECT data FROM duels WHERE winner_id IS NULL "
+                                 "AND json_extract(data, '$.status') = 'pending'").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_duel(self, duel_id):
+        self.conn.execute("DELETE FROM duels WHERE id = ?", (duel_id,))
+        self.conn.execute("DELETE FROM active_duels WHERE duel_id = ?", (duel_id,))
+
+    def pop_queue(self, count):
+        rows = self.conn.execute("SELECT position, user_id FROM queue ORDER BY position LIMIT ?", (count,)).fetchall()
+        if len(rows) < count:
+            return []
+        self.conn.executemany("DELETE FROM queue WHERE position = ?", [(row[0],) for row in rows])
+        return [row[1] for row in rows]
+
+
+class SqliteStateStore(StateStore):
+    """SQLite backend in WAL mode. Users, queue entries and duels are separate
+    rows, so a single update touches only the records it changes. Write
+    transactions start with BEGIN IMMEDIATE; readers are never blocked."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        password TEXT NOT NULL,
+        rating REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS queue (
+        position INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS duels (
+        id TEXT PRIMARY KEY,
+        winner_id TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('ratings_version', 0);
+    -- 1 once duels imported without a status and a version have been upgraded
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('duels_upgraded', 0);
+    -- Bumped by any write to users, so workers can tell rating changes apart from queue and duel traffic
+    CREATE TRIGGER IF NOT EXISTS users_inserted AFTER INSERT ON users BEGIN
+        UPDATE meta SET value = value + 1 WHERE key = 'ratings_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_updated AFTER UPDATE ON users BEGIN
+        UPDATE meta SET value = value + 1 WHERE key = 'ratings_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_deleted AFTER DELETE ON users BEGIN
+        UPDATE meta SET value = value + 1 WHERE key = 'ratings_version';
+    END;
+    CREATE INDEX IF NOT EXISTS users_username ON users (username);
+    CREATE TABLE IF NOT EXISTS active_duels (
+        user_id TEXT PRIMARY KEY,
+        duel_id TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS active_duels_duel_id ON active_duels (duel_id);
+    """
+
+    def __init__(self, path=DB_FILE):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        self._backfill_active_duels()
+        self._upgrade_duels()
+
+    def _files(self):
+        return [self.path, self.path + "-wal"]
+
+    def _backfill_active_duels(self):
+        # Databases created before the active_duels index existed
+        with self.transaction() as tx:
+            if tx.conn.execute("SELECT 1 FROM active_duels LIMIT 1").fetchone():
+                return
+            for (data,) in tx.conn.execute("SELECT data FROM duels WHERE winner_id IS NULL").fetchall():
+                duel = json.loads(data)
+                tx.conn.executemany("INSERT OR REPLACE INTO active_duels (user_id, duel_id) VALUES (?, ?)",
+                                    [(user_id, duel["id"]) for user_id in duel_players(duel)])
+
+    def _upgrade_duels(self):
+        # Duels migrated from a game_state.json written before duels had a status and a version
+        with self.transaction() as tx:
+            if tx.conn.execute("SELECT value FROM meta WHERE key = 'duels_upgraded'").fetchone()[0]:
+                return
+            tx.conn.execute("UPDATE duels SET data = json_set(data, '$.status', 'active') "
+                            "WHERE json_extract(data, '$.status') IS NULL")
+            tx.conn.execute("UPDATE duels SET data = json_set(data, '$.version', 0) "
+                            "WHERE json_extract(data, '$.version') IS NULL")
+            tx.conn.execute("UPDATE meta SET value = 1 WHERE key = 'duels_upgraded'")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, write=True):
+        conn = self._connect()
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        if write:
+            record_lock_wait(started)
+        changes = conn.total_changes
+        try:
+            yield SqliteTransaction(conn)
+            if conn.total_changes != changes:
+                # Bumped in the same transaction, so other processes see the new version together with the data
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def migrate_json_to_sqlite(json_path, store):
+    """One-shot import of a legacy game_state.json into an empty SQLite store.
+    The emptiness check and the import share one write transaction, so of several
+    workers starting together only one imports; the JSON file is renamed afterwards."""
+    if not os.path.exists(json_path):
+        return False
+    with store.transaction() as tx:
+        if tx.count_users() > 0:
+            return False
+        try:
+            with open(json_path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            # Another worker imported and renamed it since the check above
+            return False
+        for duel in state["duels"].values():
+            upgrade_duel(duel)
+        tx.save(state)
+    try:
+        os.replace(json_path, json_path + ".migrated")
+    except FileNotFoundError:
+        pass
+    logging.info(f"Migrated {len(state['users'])} users and {len(state['duels'])} duels from {json_path} to SQLite")
+    return True
+
+
+def open_store(backend=None):
+    backend = backend or os.environ.get("STATE_BACKEND", "sqlite")
+    if backend == "json":
+        return JsonStateStore(os.environ.get("STATE_FILE", DATA_FILE))
+    if backend == "sqlite":
+        store = SqliteStateStore(os.environ.get("STATE_DB", DB_FILE))
+        migrate_json_to_sqlite(DATA_FILE, store)
+        return store
+    raise ValueError(f"Unknown state backend: {backend}")
@@ -0,0 +1,143 @@
+"""Server-Sent Events endpoint for the events published through events.hub.
+
+Runs an asyncio server on its own thread next to Streamlit, so events reach
+the browser as soon as they are published instead of on the next rerun.
+Clients connect to `/stream?token=<session token>`; the token is registered
+with the hub by the Streamlit session of the logged-in user.
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs, urlsplit
+
+from events import hub
+
+STREAM_HOST = os.environ.get("STREAM_HOST", "0.0.0.0")
+STREAM_PORT = int(os.environ.get("STREAM_PORT", "8502"))
+MAX_CONNECTIONS = int(os.environ.get("STREAM_MAX_CONNECTIONS", "1000"))
+HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments on an idle stream
+SEND_TIMEOUT = 10  # seconds a client may take to accept buffered data before it is dropped
+REQUEST_TIMEOUT = 5
+MAX_HEADER_LINES = 100
+
+
+class StreamServer:
+    def __init__(self, event_hub, host=STREAM_HOST, port=STREAM_PORT, max_connections=MAX_CONNECTIONS):
+        self.hub = event_hub
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.loop = None
+        self._wakeups = defaultdict(set)  # user id -> wakeup events of that user's open streams
+        self._connections = 0
+        self.ready = threading.Event()  # set once listening; `port` is then the bound one, even when 0 was asked for
+        self.hub.add_listener(self._on_event)
+
+    @property
+    def connections(self):
+        return self._connections
+
+    def _on_event(self, user_id):
+        # Called from the thread that published the event
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake, user_id)
+
+    def _wake(self, user_id):
+        # Only the addressee's streams read the hub again; a broadcast wakes every stream
+        streams = self._wakeups.values() if user_id is None else [self._wakeups.get(user_id, ())]
+        for wakeups in streams:
+            for wakeup in wakeups:
+                wakeup.set()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        logging.info(f"Event stream listening on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            path, headers = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            url = urlsplit(path)
+            query = parse_qs(url.query)
+            user_id = self.hub.user_for_token(query.get("token", [""])[0])
+            if url.path != "/stream":
+                await self._respond(writer, "404 Not Found")
+            elif user_id is None:
+                await self._respond(writer, "403 Forbidden")
+            elif self.connections >= self.max_connections:
+                await self._respond(writer, "503 Service Unavailable", "Retry-After: 5\r\n")
+            else:
+                last_seq = headers.get("last-event-id") or query.get("last_event_id", ["0"])[0]
+                await self._stream(writer, user_id, int(last_seq) if last_seq.isdigit() else 0)
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1")
+        method, path, _ = request_line.split(" ", 2)
+        if method != "GET":
+            raise ValueError(f"Unsupported method {method}")
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                return path, headers
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        raise ValueError("Too many header lines")
+
+    async def _respond(self, writer, status, extra_headers=""):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n{extra_headers}Connection: close\r\n\r\n".encode())
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    async def _stream(self, writer, user_id, seq):
+        wakeup = asyncio.Event()
+        self._wakeups[user_id].add(wakeup)
+        self._connections += 1
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\n"
+                         b"Access-Control-Allow-Origin: *\r\n\r\n")
+            while True:
+                # Cleared before reading so an event published meanwhile wakes us up again
+                wakeup.clear()
+                events, seq = self.hub.fetch_since(user_id, seq)
+                if events:
+                    for payload in events[:-1]:
+                        writer.write(f"data: {payload}\n\n".encode())
+                    writer.write(f"id: {seq}\ndata: {events[-1]}\n\n".encode())
+                # A client that stops reading is dropped instead of buffering without bound
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b": heartbeat\n\n")
+        finally:
+            self._connections -= 1
+            self._wakeups[user_id].discard(wakeup)
+            if not self._wakeups[user_id]:
+                del self._wakeups[user_id]
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def ensure_started(event_hub=hub):
+    """Starts the stream server on a daemon thread once per process."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = StreamServer(event_hub)
+            threading.Thread(target=asyncio.run, args=(_server.serve(),), name="event-stream", daemon=True).start()
+        return _server
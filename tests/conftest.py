@@ -0,0 +1,34 @@
+import pytest
+
+from auth import PasswordHasher
+from benchmarks.stub_ai_server import StubAIServer
+from debug_duel import Game
+from events import EventHub
+from hyperskill_ai_api import HyperskillAIAPI
+from state_store import JsonStateStore
+
+BCRYPT_ROUNDS = 4  # the minimum, tests don't measure login cost
+
+
+@pytest.fixture(scope="session")
+def stub_ai():
+    server = StubAIServer(chunk_delay=0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def ai_api(stub_ai):
+    return HyperskillAIAPI("stub", "stub-model", url=stub_ai.url)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JsonStateStore(str(tmp_path / "game_state.json"), str(tmp_path / "game_state.lock"))
+
+
+@pytest.fixture
+def game(store, ai_api):
+    game = Game(store, ai_api, events=EventHub(), hasher=PasswordHasher(rounds=BCRYPT_ROUNDS))
+    yield game
+    game.duel_workers.shutdown()
@@ -0,0 +1,103 @@
+import pytest
+
+import auth
+from auth import PasswordHasher, RateLimited, hash_rounds
+from tests.conftest import BCRYPT_ROUNDS
+
+MAX_FAILURES = 3
+WINDOW = 300
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(rounds=BCRYPT_ROUNDS, max_failures=MAX_FAILURES, window=WINDOW)
+    yield hasher
+    hasher._pool.shutdown()
+
+
+@pytest.fixture
+def hashed(hasher):
+    return hasher.hash("secret")
+
+
+def fail(hasher, hashed, username="ada", times=MAX_FAILURES):
+    for _ in range(times):
+        assert hasher.verify(username, "wrong", hashed) == (False, None)
+
+
+def test_verify(hasher, hashed):
+    assert hash_rounds(hashed) == BCRYPT_ROUNDS
+    assert hasher.verify("ada", "secret", hashed) == (True, None)
+    assert hasher.verify("ada", "wrong", hashed) == (False, None)
+
+
+def test_too_many_failures_are_rate_limited(hasher, hashed, clock):
+    fail(hasher, hashed)
+    clock.now += 100
+
+    with pytest.raises(RateLimited) as limited:
+        hasher.verify("ada", "secret", hashed)
+    assert limited.value.retry_after == WINDOW - 100
+    assert hasher.verify("bob", "secret", hashed) == (True, None)
+
+
+def test_failures_expire_after_the_window(hasher, hashed, clock):
+    fail(hasher, hashed)
+    clock.now += WINDOW + 1
+
+    assert hasher.verify("ada", "secret", hashed) == (True, None)
+
+
+def test_oldest_failure_expiring_lifts_the_limit(hasher, hashed, clock):
+    fail(hasher, hashed, times=1)
+    clock.now += 200
+    fail(hasher, hashed, times=MAX_FAILURES - 1)
+
+    with pytest.raises(RateLimited) as limited:
+        hasher.verify("ada", "secret", hashed)
+    assert limited.value.retry_after == WINDOW - 200
+    clock.now += WINDOW - 200 + 1
+    assert hasher.verify("ada", "secret", hashed) == (True, None)
+
+
+def test_successful_login_clears_the_failures(hasher, hashed, clock):
+    fail(hasher, hashed, times=MAX_FAILURES - 1)
+    assert hasher.verify("ada", "secret", hashed) == (True, None)
+
+    fail(hasher, hashed, times=MAX_FAILURES - 1)
+    assert hasher.verify("ada", "secret", hashed) == (True, None)
+
+
+def test_hash_of_another_cost_is_replaced(hasher, hashed):
+    stronger = PasswordHasher(rounds=BCRYPT_ROUNDS + 1)
+    try:
+        ok, new_hash = stronger.verify("ada", "secret", hashed)
+        assert ok and hash_rounds(new_hash) == BCRYPT_ROUNDS + 1
+        assert stronger.verify("ada", "secret", new_hash) == (True, None)
+    finally:
+        stronger._pool.shutdown()
+
+
+def test_login_stores_the_rehashed_password(game):
+    user_id = game.register("ada", "secret")
+    game.hasher.rounds = BCRYPT_ROUNDS + 1
+
+    assert game.authenticate("ada", "secret") == user_id
+
+    assert hash_rounds(game.get_user(user_id)["password"]) == BCRYPT_ROUNDS + 1
+    assert game.authenticate("ada", "secret") == user_id
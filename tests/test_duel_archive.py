@@ -0,0 +1,119 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from duel_archive import DuelArchive, archive_finished_duels
+from state_store import JsonTransaction
+
+SNIPPET = "total = 0\nfor value in values:\n    total += value"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return DuelArchive(str(tmp_path / "duel_archive.db"))
+
+
+def make_duel(duel_id, user1_id="1", user2_id="2", winner_id="1", age=7200, code=SNIPPET):
+    start_time = (datetime.now(timezone.utc) - timedelta(seconds=age)).isoformat()
+    return {"id": duel_id, "user1_id": user1_id, "user2_id": user2_id, "winner_id": winner_id,
+            "start_time": start_time, "status": "active", "version": 0, "code_snippet": code, "error_lines": [1],
+            "errors_found": {user1_id: [1], user2_id: []}, "is_bot_duel": False, "bot_difficulty": None}
+
+
+def put_duels(store, *duels):
+    def put(tx):
+        for duel in duels:
+            tx.put_duel(duel)
+
+    store.update_state(put)
+
+
+def snippet_count(archive):
+    with sqlite3.connect(archive.path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM snippets").fetchone()[0]
+
+
+def test_only_old_finished_duels_are_archived(store, archive):
+    put_duels(store, make_duel("old"), make_duel("old-too"), make_duel("recent", age=60),
+              make_duel("open", winner_id=None))
+
+    assert archive_finished_duels(store, archive, older_than=3600) == 2
+
+    assert {duel_id for duel_id in ("old", "old-too") if store.get_duel(duel_id) is None} == {"old", "old-too"}
+    assert store.get_duel("recent") is not None and store.get_duel("open") is not None
+    archived = archive.get("old")
+    assert archived["code_snippet"] == SNIPPET and archived["winner_id"] == "1"
+    assert snippet_count(archive) == 1  # both duels share the snippet
+
+
+def test_failed_archiving_leaves_the_duels_in_the_store(store, archive, monkeypatch):
+    put_duels(store, make_duel("d1"))
+
+    def broken(duels):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(archive, "append", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        archive_finished_duels(store, archive)
+
+    assert store.get_duel("d1") is not None
+
+
+def test_duels_left_in_both_places_are_archived_once(store, archive, monkeypatch):
+    put_duels(store, make_duel("d1"))
+
+    def broken(tx, duel_id):
+        raise OSError("worker died")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(JsonTransaction, "delete_duel", broken)
+        with pytest.raises(OSError):
+            archive_finished_duels(store, archive)
+    assert store.get_duel("d1") is not None and archive.contains("d1")
+
+    assert archive_finished_duels(store, archive) == 1
+    assert store.get_duel("d1") is None
+    assert len(archive) == 1
+
+
+def test_append_skips_archived_duels(archive):
+    assert archive.append([make_duel("d1"), make_duel("d2", code="other")]) == 2
+    assert archive.append([make_duel("d2"), make_duel("d3")]) == 1
+    assert len(archive) == 3
+
+
+def pages(archive, **filters):
+    result, cursor = [], None
+    while True:
+        page, cursor = archive.history(before=cursor, limit=2, **filters)
+        result.append([duel["id"] for duel in page])
+        if cursor is None:
+            return result
+
+
+def test_history_pages_newest_first(archive):
+    archive.append([make_duel(f"d{i}") for i in range(1, 6)])
+
+    assert pages(archive) == [["d5", "d4"], ["d3", "d2"], ["d1"]]
+    assert archive.history(limit=5) == (archive.history(limit=10)[0], None)
+
+
+def test_history_of_one_user(archive):
+    archive.append([make_duel("d1", "1", "2"), make_duel("d2", "3", "4"), make_duel("d3", "2", "3"),
+                    make_duel("d4", "2", "1"), make_duel("d5", "5", "2")])
+
+    assert pages(archive, user_id="2") == [["d5", "d4"], ["d3", "d1"]]
+    assert pages(archive, user_id="9") == [[]]
+
+
+def test_history_cursor_is_stable_while_duels_are_archived(archive):
+    archive.append([make_duel(f"d{i}") for i in range(1, 5)])
+    first, cursor = archive.history(limit=2)
+
+    archive.append([make_duel("d5"), make_duel("d6")])
+    second, cursor = archive.history(before=cursor, limit=2)
+
+    assert [duel["id"] for duel in first] == ["d4", "d3"]
+    assert [duel["id"] for duel in second] == ["d2", "d1"]
+    assert cursor is None
@@ -0,0 +1,236 @@
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import debug_duel.core
+from auth import PasswordHasher
+from debug_duel import BotDifficulty, DuelClosedError, Game, UsernameTakenError
+from events import EventHub
+from rating_replay import BOT_RATING_CHANGES, INITIAL_RATING
+from state_store import JsonStateStore, SqliteStateStore, migrate_json_to_sqlite
+from tests.conftest import BCRYPT_ROUNDS
+
+BUG_LINES = [3, 4, 5]  # of benchmarks.stub_ai_server.SNIPPET_RESPONSE
+TIMEOUT = 10
+
+
+def wait_until_active(game, duel_id):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        duel = game.get_duel(duel_id)
+        if duel["status"] != "pending":
+            return duel
+        time.sleep(0.01)
+    raise AssertionError(f"Duel {duel_id} is still pending")
+
+
+def events_of(game, user_id, event_type=None):
+    payloads, _ = game.events.fetch_since(user_id)
+    events = [json.loads(payload) for payload in payloads]
+    return [event for event in events if event_type is None or event["type"] == event_type]
+
+
+def start_match(game):
+    alice = game.register("alice", "secret-a")
+    bob = game.register("bob", "secret-b")
+    assert game.find_opponent(alice) is None
+    duel_id = game.find_opponent(bob)
+    assert duel_id is not None
+    return alice, bob, wait_until_active(game, duel_id)
+
+
+def test_core_does_not_import_streamlit(game):
+    assert "streamlit" not in sys.modules
+
+
+def test_register_and_authenticate(game):
+    user_id = game.register("ada", "secret")
+
+    assert game.get_user(user_id)["rating"] == INITIAL_RATING
+    assert game.username_taken("ada")
+    assert game.authenticate("ada", "secret") == user_id
+    assert game.authenticate("ada", "wrong") is None
+    assert game.authenticate("nobody", "secret") is None
+    with pytest.raises(UsernameTakenError):
+        game.register("ada", "other")
+
+
+def test_match_attaches_a_snippet(game):
+    alice, bob, duel = start_match(game)
+
+    assert duel["status"] == "active"
+    assert duel["error_lines"] == BUG_LINES
+    assert duel["topic_id"] in game.catalog.ids()
+    assert game.active_duel_id(alice) == game.active_duel_id(bob) == duel["id"]
+    assert game.store.get_queue() == []
+    assert [event["type"] for event in events_of(game, alice)] == ["new_duel"]
+
+
+def test_submit_settles_once_both_players_submitted(game):
+    alice, bob, duel = start_match(game)
+
+    after_first = game.submit_guesses(duel["id"], alice, BUG_LINES)
+    assert after_first["winner_id"] is None
+    assert events_of(game, bob)[-1]["type"] == "duel_update"
+
+    game.submit_guesses(duel["id"], bob, [1, 2])
+    settled = game.get_duel(duel["id"])
+    assert settled["winner_id"] == alice
+    assert game.get_user(alice)["rating"] > INITIAL_RATING > game.get_user(bob)["rating"]
+    assert game.active_duel_id(alice) is None
+    assert [event["result"] for event in events_of(game, alice, "duel_result")] == ["win"]
+    assert [row["username"] for row in game.leaderboard()] == ["alice", "bob"]
+
+
+def test_tie_leaves_ratings_unchanged(game):
+    alice, bob, duel = start_match(game)
+
+    game.submit_guesses(duel["id"], alice, [3, 4])
+    game.submit_guesses(duel["id"], bob, [4, 5])
+
+    assert game.get_duel(duel["id"])["winner_id"] == "tie"
+    assert game.get_user(alice)["rating"] == game.get_user(bob)["rating"] == INITIAL_RATING
+    assert [event["result"] for event in events_of(game, bob, "duel_result")] == ["tie"]
+
+
+def test_bot_duel_settles_on_the_first_submission(game):
+    user_id = game.register("ada", "secret")
+    duel = wait_until_active(game, game.create_bot_duel(user_id, BotDifficulty.HARD))
+
+    game.submit_guesses(duel["id"], user_id, [1])
+
+    settled = game.get_duel(duel["id"])
+    assert settled["errors_found"]["bot_hard"] == BUG_LINES
+    assert settled["winner_id"] == "bot_hard"
+    assert game.get_user(user_id)["rating"] == INITIAL_RATING + BOT_RATING_CHANGES["hard"][1]
+
+
+def test_settled_duel_rejects_guesses(game):
+    alice, bob, duel = start_match(game)
+    game.submit_guesses(duel["id"], alice, BUG_LINES)
+    game.submit_guesses(duel["id"], bob, [1])
+    settled = game.get_duel(duel["id"])
+
+    with pytest.raises(DuelClosedError):
+        game.submit_guesses(duel["id"], bob, BUG_LINES)
+    assert game.get_duel(duel["id"]) == settled
+
+
+def test_pending_duel_rejects_guesses(game):
+    user_id = game.register("ada", "secret")
+    duel_id = store_pending_duel(game, user_id)
+
+    with pytest.raises(DuelClosedError):
+        game.submit_guesses(duel_id, user_id, [1])
+
+
+def store_pending_duel(game, user_id, started=None):
+    duel = game.new_duel(user_id, "bot_easy")
+    duel.is_bot_duel = True
+    duel.bot_difficulty = BotDifficulty.EASY.value
+    if started is not None:
+        duel.start_time = started.isoformat()
+    game.store.put_duel(duel.__dict__)
+    return duel.id
+
+
+def test_pending_duels_are_recovered(game):
+    user_id = game.register("ada", "secret")
+    fresh = store_pending_duel(game, user_id)
+    stale = store_pending_duel(game, "other", datetime.now(timezone.utc) - timedelta(hours=1))
+
+    game.recover_pending_duels(grace=0)
+
+    assert wait_until_active(game, fresh)["status"] == "active"
+    assert game.get_duel(stale)["status"] == "cancelled"
+
+
+def test_recently_created_duels_get_a_grace_period(game):
+    user_id = game.register("ada", "secret")
+    duel_id = store_pending_duel(game, user_id)
+
+    game.recover_pending_duels(grace=0.2)
+
+    assert game.get_duel(duel_id)["status"] == "pending"
+    assert wait_until_active(game, duel_id)["status"] == "active"
+
+
+def test_start_recovers_once(game, monkeypatch):
+    user_id = game.register("ada", "secret")
+    store_pending_duel(game, user_id, datetime.now(timezone.utc) - timedelta(seconds=120))
+    prepared = []
+    monkeypatch.setattr(game, "prepare_duel", prepared.append)
+    monkeypatch.setattr(game.snippet_pool, "start", lambda: None)
+    monkeypatch.setattr(game.matchmaker, "start", lambda: None)
+
+    for _ in range(3):
+        game.start()
+
+    assert len(prepared) == 1
+
+
+def test_failed_preparation_cancels_the_duel(game, monkeypatch):
+    user_id = game.register("ada", "secret")
+    duel_id = store_pending_duel(game, user_id)
+
+    def crash(duel_id):
+        raise RuntimeError("worker crashed")
+
+    monkeypatch.setattr(game, "attach_snippet", crash)
+    game.prepare_duel(duel_id)
+
+    assert wait_until_active(game, duel_id)["status"] == "cancelled"
+    assert game.active_duel_id(user_id) is None
+
+
+def test_other_workers_ratings_reach_the_ranking(game, monkeypatch):
+    monkeypatch.setattr(debug_duel.core, "LEADERBOARD_REFRESH", 0)
+    user_id = game.register("ada", "secret")
+    assert game.leaderboard() == [{"username": "ada", "rating": INITIAL_RATING}]
+
+    # Another worker settles a duel of this user
+    user = game.store.get_user(user_id)
+    user["rating"] = INITIAL_RATING + 16
+    game.store.put_user(user)
+
+    assert game.leaderboard() == [{"username": "ada", "rating": INITIAL_RATING + 16}]
+    assert game.events.broadcast_seq("leaderboard_update") > 0
+
+
+def baseline_state():
+    """A game_state.json as the single-file app wrote it: duels have no status, version or topic id."""
+    users = {user_id: {"id": user_id, "username": name, "password": "hash", "rating": INITIAL_RATING}
+             for user_id, name in (("1", "alice"), ("2", "bob"))}
+    duel = {"id": "1700000000000", "user1_id": "1", "user2_id": "2", "winner_id": None,
+            "code_snippet": "a = 1\nb = 2\nc = 3\nd = 4\ne = 5", "error_lines": BUG_LINES,
+            "start_time": datetime.now(timezone.utc).isoformat(), "errors_found": {"1": [], "2": []},
+            "submission_time": {"1": None, "2": None}, "accepted_by": [], "is_bot_duel": False,
+            "bot_difficulty": None, "topic": ["Loops", "Python"]}
+    return {"users": users, "queue": [], "duels": {duel["id"]: duel}}
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_baseline_duels_can_be_played(tmp_path, ai_api, backend):
+    json_path = str(tmp_path / "game_state.json")
+    with open(json_path, "w") as f:
+        json.dump(baseline_state(), f)
+    if backend == "json":
+        store = JsonStateStore(json_path, str(tmp_path / "game_state.lock"))
+    else:
+        store = SqliteStateStore(str(tmp_path / "game_state.db"))
+        assert migrate_json_to_sqlite(json_path, store)
+    game = Game(store, ai_api, events=EventHub(), hasher=PasswordHasher(rounds=BCRYPT_ROUNDS))
+    try:
+        game.recover_pending_duels()
+        duel_id = game.active_duel_id("1")
+        assert game.get_duel(duel_id)["version"] == 0
+
+        game.submit_guesses(duel_id, "1", BUG_LINES)
+        game.submit_guesses(duel_id, "2", [1])
+
+        assert game.get_duel(duel_id)["winner_id"] == "1"
+    finally:
+        game.duel_workers.shutdown()
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+
+import pytest
+import requests
+
+from benchmarks.stub_ai_server import SNIPPET_RESPONSE, StubAIServer
+from hyperskill_ai_api import (AsyncHyperskillAIAPI, CircuitBreaker, CircuitOpenError, HyperskillAIAPI,
+                               iter_content_chunks)
+from llm_cache import LLMCache
+
+MESSAGES = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Explain the bugs."}]
+
+
+class FakeResponse:
+    """Just what iter_content_chunks reads from a requests.Response."""
+
+    def __init__(self, lines, content_type="text/event-stream"):
+        self.headers = {"Content-Type": content_type}
+        self.encoding = None
+        self.lines = lines
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(str(tmp_path / "llm_cache.db"))
+
+
+def test_stream_yields_chunks_in_order(stub_ai, ai_api):
+    chunks = list(ai_api.stream_chat_completion(MESSAGES))
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == SNIPPET_RESPONSE
+
+
+def test_stream_falls_back_to_a_json_body():
+    server = StubAIServer(streaming=False).start()
+    try:
+        api = HyperskillAIAPI("stub", "stub-model", url=server.url)
+        assert list(api.stream_chat_completion(MESSAGES)) == [SNIPPET_RESPONSE]
+    finally:
+        server.stop()
+
+
+def test_streamed_answer_is_cached(stub_ai, ai_api, cache):
+    streamed = "".join(ai_api.stream_chat_completion(MESSAGES, cache=cache))
+    requests_made = stub_ai.requests
+
+    assert list(ai_api.stream_chat_completion(MESSAGES, cache=cache)) == [streamed]
+    assert ai_api.get_chat_completion(MESSAGES, cache=cache) == streamed
+    assert stub_ai.requests == requests_made
+
+
+def test_chunks_after_done_are_dropped():
+    response = FakeResponse([": heartbeat", "", 'data: {"content": "one "}', "event: ping",
+                             'data: {"content": "two"}', "data: [DONE]", 'data: {"content": "late"}'])
+
+    assert list(iter_content_chunks(response)) == ["one ", "two"]
+
+
+def test_non_json_data_is_yielded_as_text():
+    response = FakeResponse(["data: plain text", 'data: {"content": ""}', "data: [DONE]"])
+
+    assert list(iter_content_chunks(response)) == ["plain text"]
+
+
+def test_gather_keeps_the_batch_order_and_the_concurrency():
+    server = StubAIServer(delay=0.05, content=lambda payload: payload["messages"][-1]["content"]).start()
+    api = AsyncHyperskillAIAPI("stub", "stub-model", url=server.url, concurrency=4)
+    batch = [[{"role": "user", "content": f"request {i}"}] for i in range(40)]
+    try:
+        assert asyncio.run(api.gather_completions(batch)) == [f"request {i}" for i in range(40)]
+        assert server.max_in_flight == 4
+
+        # Above the client's own threads and the event loop's default executor
+        server.max_in_flight = 0
+        server.delay = 0.2
+        asyncio.run(api.gather_completions(batch, concurrency=40))
+        assert server.max_in_flight > min(32, os.cpu_count() + 4)
+    finally:
+        api.close()
+        server.stop()
+
+
+@pytest.fixture
+def flaky_ai():
+    server = StubAIServer().start()
+    yield server
+    server.stop()
+
+
+def flaky_api(server, **options):
+    options.setdefault("backoff", 0)
+    return HyperskillAIAPI("stub", "stub-model", url=server.url, **options)
+
+
+def test_failed_calls_are_retried(flaky_ai):
+    flaky_ai.errors.extend([(503, None), (500, None)])
+    api = flaky_api(flaky_ai)
+
+    assert api.get_chat_completion(MESSAGES) == SNIPPET_RESPONSE
+    assert flaky_ai.requests == 3
+    assert api.last_call["retries"] == 2
+
+
+def test_retries_are_limited(flaky_ai):
+    flaky_ai.errors.extend([(503, None)] * 3)
+    api = flaky_api(flaky_ai, max_retries=2)
+
+    with pytest.raises(requests.HTTPError):
+        api.get_chat_completion(MESSAGES)
+    assert flaky_ai.requests == 3
+
+
+def test_retry_after_is_honoured(flaky_ai):
+    flaky_ai.errors.append((429, "1"))
+    api = flaky_api(flaky_ai)
+
+    started = time.monotonic()
+    assert api.get_chat_completion(MESSAGES) == SNIPPET_RESPONSE
+    assert time.monotonic() - started >= 1
+
+
+def test_retry_after_beyond_the_limit_fails_at_once(flaky_ai):
+    flaky_ai.errors.append((429, "3600"))
+    api = flaky_api(flaky_ai, read_timeout=5)
+
+    started = time.monotonic()
+    with pytest.raises(requests.HTTPError):
+        api.get_chat_completion(MESSAGES)
+    assert time.monotonic() - started < 1
+    assert flaky_ai.requests == 1
+
+
+def test_circuit_opens_after_consecutive_failures(flaky_ai):
+    flaky_ai.errors.extend([(503, None)] * 2)
+    api = flaky_api(flaky_ai, max_retries=0, circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            api.get_chat_completion(MESSAGES)
+    with pytest.raises(CircuitOpenError):
+        api.get_chat_completion(MESSAGES)
+    assert flaky_ai.requests == 2
+
+
+def test_circuit_lets_a_trial_call_through_after_the_timeout(flaky_ai):
+    flaky_ai.errors.append((503, None))
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    api = flaky_api(flaky_ai, max_retries=0, circuit_breaker=breaker)
+
+    with pytest.raises(requests.HTTPError):
+        api.get_chat_completion(MESSAGES)
+    with pytest.raises(CircuitOpenError):
+        api.get_chat_completion(MESSAGES)
+    time.sleep(0.1)
+    assert api.get_chat_completion(MESSAGES) == SNIPPET_RESPONSE
+    assert api.get_chat_completion(MESSAGES) == SNIPPET_RESPONSE
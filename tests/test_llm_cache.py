@@ -0,0 +1,70 @@
+import pytest
+
+import llm_cache
+from llm_cache import CacheMiss, LLMCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache, "time", clock)
+    return clock
+
+
+def make_cache(tmp_path, **options):
+    return LLMCache(str(tmp_path / "llm_cache.db"), **options)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.put("key", "answer")
+
+    clock.now += 60
+    assert cache.get("key") == "answer"
+    clock.now += 1
+    assert cache.get("key") is None
+    clock.now -= 1
+    assert cache.get("key") is None  # the expired entry was dropped
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    for key in ("a", "b"):
+        clock.now += 1
+        cache.put(key, key.upper())
+    clock.now += 1
+    assert cache.get("a") == "A"  # now used more recently than b
+
+    clock.now += 1
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+
+def test_offline_cache_raises_on_a_miss(tmp_path):
+    cache = make_cache(tmp_path, offline=True)
+
+    with pytest.raises(CacheMiss):
+        cache.get_or_compute("key", lambda: pytest.fail("an offline cache called the provider"))
+
+
+def test_rejected_content_is_not_stored(tmp_path):
+    cache = make_cache(tmp_path)
+
+    def reject(content):
+        raise ValueError(content)
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute("key", lambda: "invalid", validate=reject)
+    assert cache.get("key") is None
+    assert cache.get_or_compute("key", lambda: "valid", validate=len) == "valid"
+    assert cache.get("key") == "valid"
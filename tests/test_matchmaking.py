@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from matchmaking import Matchmaker
+
+BASE_BAND = 100
+BAND_GROWTH = 20
+MAX_BAND = 300
+
+
+class QueueStore:
+    """Just the queue the matchmaker reads from a StateStore."""
+
+    def __init__(self):
+        self.queue = {}
+        self.on_read = None
+
+    def get_queue(self):
+        queue = list(self.queue.items())
+        if self.on_read is not None:
+            self.on_read()
+        return queue
+
+
+@pytest.fixture
+def store():
+    return QueueStore()
+
+
+@pytest.fixture
+def matches():
+    return []
+
+
+@pytest.fixture
+def matchmaker(store, matches):
+    def on_match(user1_id, user2_id):
+        store.queue.pop(user1_id)
+        store.queue.pop(user2_id)
+        matches.append({user1_id, user2_id})
+        return f"duel{len(matches)}"
+
+    return Matchmaker(store, on_match, base_band=BASE_BAND, band_growth=BAND_GROWTH, max_band=MAX_BAND)
+
+
+def enqueue(store, matchmaker, user_id, rating, now):
+    store.queue[user_id] = rating
+    return matchmaker.enqueue(user_id, rating, now=now)
+
+
+def test_band_widens_with_waiting_up_to_the_maximum(store, matchmaker):
+    enqueue(store, matchmaker, "a", 1000, now=0)
+
+    assert matchmaker.band("a", now=0) == BASE_BAND
+    assert matchmaker.band("a", now=5) == BASE_BAND + 5 * BAND_GROWTH
+    assert matchmaker.band("a", now=60) == MAX_BAND
+
+
+def test_nearest_player_within_the_band_is_matched_at_once(store, matchmaker, matches):
+    enqueue(store, matchmaker, "a", 1000, now=0)
+    enqueue(store, matchmaker, "far", 1150, now=0)
+
+    assert enqueue(store, matchmaker, "b", 1020, now=0) == "duel1"
+    assert matches == [{"a", "b"}]
+    assert len(matchmaker) == 1
+
+
+def test_players_outside_the_band_wait_until_it_has_widened(store, matchmaker, matches):
+    enqueue(store, matchmaker, "a", 1000, now=0)
+
+    assert enqueue(store, matchmaker, "b", 1200, now=0) is None
+    assert matchmaker.tick(now=4) == []  # bands of 180
+    assert matchmaker.tick(now=5) == ["duel1"]  # bands of 200
+    assert matches == [{"a", "b"}]
+
+
+def test_players_beyond_the_maximum_band_are_never_matched(store, matchmaker):
+    enqueue(store, matchmaker, "a", 1000, now=0)
+    enqueue(store, matchmaker, "b", 1000 + MAX_BAND + 1, now=0)
+
+    assert matchmaker.tick(now=3600) == []
+    assert len(matchmaker) == 2
+
+
+def test_tick_resyncs_with_the_stored_queue(store, matchmaker):
+    enqueue(store, matchmaker, "left", 1000, now=0)
+    del store.queue["left"]  # left the queue through another worker
+    store.queue["other"] = 2000  # queued on another worker
+
+    matchmaker.tick(now=1)
+
+    assert len(matchmaker) == 1
+    assert matchmaker.band("other", now=1) == BASE_BAND
+
+
+def test_player_enqueued_during_a_tick_keeps_their_wait(store, matchmaker):
+    enqueue(store, matchmaker, "a", 1000, now=0)
+    joining = threading.Thread(target=enqueue, args=(store, matchmaker, "b", 2000, 10))
+
+    def enqueue_after_the_read():
+        store.on_read = None
+        joining.start()
+        joining.join(timeout=0.1)
+
+    store.on_read = enqueue_after_the_read
+    matchmaker.tick(now=10)
+    joining.join()
+    matchmaker.tick(now=20)
+
+    assert matchmaker.band("b", now=20) == BASE_BAND + 10 * BAND_GROWTH
@@ -0,0 +1,61 @@
+import pytest
+
+import rating_replay
+from rating_replay import INITIAL_RATING, replay_and_write, replay_store
+from state_store import JsonStateStore, SqliteStateStore, empty_state
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def history_store(request, tmp_path):
+    if request.param == "json":
+        store = JsonStateStore(str(tmp_path / "game_state.json"), str(tmp_path / "game_state.lock"))
+    else:
+        store = SqliteStateStore(str(tmp_path / "game_state.db"))
+    state = empty_state()
+    for user_id in ("1", "2"):
+        state["users"][user_id] = {"id": user_id, "username": f"user{user_id}", "password": "hash",
+                                   "rating": INITIAL_RATING}
+    state["duels"]["d1"] = {"id": "d1", "user1_id": "1", "user2_id": "2", "winner_id": "1",
+                            "start_time": "2024-01-01T00:00:00+00:00", "is_bot_duel": False, "bot_difficulty": None,
+                            "code_snippet": "x = 1", "status": "active", "version": 1}
+    store.save(state)
+    return store
+
+
+def set_rating(store, user_id, rating):
+    user = store.get_user(user_id)
+    user["rating"] = rating
+    store.put_user(user)
+
+
+def test_replay_store_reads_no_whole_state(history_store, monkeypatch):
+    monkeypatch.setattr(history_store, "load", lambda: pytest.fail("replay_store loaded the whole state"))
+
+    ratings = replay_store(history_store)
+
+    assert ratings["1"] == INITIAL_RATING + 16 and ratings["2"] == INITIAL_RATING - 16
+
+
+def test_replay_and_write_stores_the_replay(history_store):
+    ratings, changed = replay_and_write(history_store)
+
+    assert changed == 2
+    assert history_store.get_user("1")["rating"] == ratings["1"] == INITIAL_RATING + 16
+
+
+def test_ratings_changed_during_the_replay_are_replayed_again(history_store, monkeypatch):
+    replays = []
+
+    def replay_with_a_settlement(store, archive=None, **params):
+        replays.append(params)
+        if len(replays) == 1:
+            # A duel is settled by the game while the replay runs
+            set_rating(store, "2", INITIAL_RATING + 5)
+        return replay_store(store, archive, **params)
+
+    monkeypatch.setattr(rating_replay, "replay_store", replay_with_a_settlement)
+
+    ratings, _ = replay_and_write(history_store)
+
+    assert len(replays) == 2
+    assert history_store.get_user("2")["rating"] == ratings["2"]
@@ -0,0 +1,113 @@
+import json
+import os
+import random
+
+import pytest
+
+from snippet_parser import MAX_LINES, SnippetRejected, parse_snippet
+
+CORPUS = os.path.join(os.path.dirname(__file__), "snippet_corpus.jsonl")
+FUZZ_SEED = 1234
+FUZZ_CASES = 2000
+
+INTROS = ["", "Here is the snippet:", "Sure! Here's a buggy snippet.", "Certainly, here is the code:",
+          "Below is the code with three bugs."]
+FENCES = [None, "```", "```python", "```kotlin"]
+OUTROS = ["", "This code has three subtle bugs.", "Can you find them?"]
+HEADERS = ["**BUGS LIST**", "BUGS LIST:", "## Bugs List", "**Bug list:**", "BUGS_LIST"]
+BUG_FORMATS = ["{n}: {fix}", "- Line {n} - {fix}", "Line {n}: {fix}", "{n}. {fix}", "* #{n}) {fix}",
+               "Line number {n}: {fix}"]
+CHATTER = ["", "Let me know if you need another one!", "Good luck!"]
+
+
+def load_corpus():
+    with open(CORPUS) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("case", load_corpus(), ids=lambda case: case["name"])
+def test_corpus(case):
+    if "reason" in case:
+        with pytest.raises(SnippetRejected) as rejected:
+            parse_snippet(case["response"])
+        assert rejected.value.reason == case["reason"]
+    else:
+        snippet = parse_snippet(case["response"])
+        assert snippet.code == case["code"]
+        assert snippet.bug_lines == case["bug_lines"]
+
+
+def random_snippet(rng):
+    """(code lines, {bug line: fix}) of a valid snippet."""
+    code = [f"{'    ' * rng.randint(0, 2)}value{i} = compute({i})" for i in range(rng.randint(3, MAX_LINES - 1))]
+    if rng.random() < 0.3:
+        code.insert(rng.randint(1, len(code) - 1), "")
+    bugs = {n: f"fix number {n}" for n in rng.sample(range(1, len(code) + 1), 3)}
+    return code, bugs
+
+
+def render(rng, code, bugs):
+    """A response for the snippet in one of the formats the model drifts between."""
+    lines = []
+    intro = rng.choice(INTROS)
+    if intro:
+        lines += [intro] + [""] * rng.randint(0, 1)
+    fence = rng.choice(FENCES)
+    if fence:
+        lines.append(fence)
+    lines += code
+    if fence and rng.random() < 0.9:
+        lines.append("```")
+        if outro := rng.choice(OUTROS):
+            lines.append(outro)
+    lines += [""] * rng.randint(0, 2)
+    lines.append(rng.choice(HEADERS))
+    lines += [""] * rng.randint(0, 1)
+    bug_lines = list(bugs.items())
+    rng.shuffle(bug_lines)
+    if rng.random() < 0.2:
+        bug_lines.append(bug_lines[0])
+    lines += [rng.choice(BUG_FORMATS).format(n=n, fix=fix) for n, fix in bug_lines]
+    if chatter := rng.choice(CHATTER):
+        lines += ["", chatter]
+    return "\n".join(lines)
+
+
+def test_fuzz_formatting_drift_keeps_the_answer_key():
+    rng = random.Random(FUZZ_SEED)
+    for _ in range(FUZZ_CASES):
+        code, bugs = random_snippet(rng)
+        response = render(rng, code, bugs)
+        snippet = parse_snippet(response)
+        assert snippet.code == "\n".join(code), response
+        assert snippet.bug_lines == sorted(bugs), response
+
+
+def mutate(rng, response):
+    lines = response.split("\n")
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(lines) + 1)
+        choice = rng.random()
+        if choice < 0.4 and i < len(lines):
+            del lines[i]
+        elif choice < 0.7:
+            lines.insert(i, rng.choice(["```", "", "Some words.", "x = 1", "7: extra", "**BUGS LIST**"]))
+        elif i < len(lines) and lines[i]:
+            j = rng.randrange(len(lines[i]))
+            lines[i] = lines[i][:j] + lines[i][j + 1:]
+    return "\n".join(lines)
+
+
+def test_fuzz_mutations_are_rejected_or_valid():
+    rng = random.Random(FUZZ_SEED)
+    for _ in range(FUZZ_CASES):
+        code, bugs = random_snippet(rng)
+        response = mutate(rng, render(rng, code, bugs))
+        try:
+            snippet = parse_snippet(response)
+        except SnippetRejected:
+            continue
+        lines = snippet.code.split("\n")
+        assert len(lines) <= MAX_LINES, response
+        assert len(snippet.bug_lines) == len(snippet.fixes) == 3, response
+        assert all(1 <= n <= len(lines) for n in snippet.bug_lines), response
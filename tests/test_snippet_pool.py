@@ -0,0 +1,37 @@
+import time
+
+from snippet_pool import SnippetPool
+
+SNIPPET = ("code", [1, 2, 3])
+TIMEOUT = 5
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_failing_topic_does_not_starve_the_others():
+    calls = []
+
+    def generate(topic):
+        calls.append(topic)
+        if topic == "broken":
+            raise ValueError("rejected")
+        return SNIPPET
+
+    pool = SnippetPool(generate, ["broken", "a", "b"], depth=2)
+    pool.start()
+
+    wait_for(lambda: pool.size("a") == pool.size("b") == 2)
+    assert calls.count("broken") == 1
+    assert pool.size("broken") == 0
+
+
+def test_take_falls_back_to_generating():
+    pool = SnippetPool(lambda topic: SNIPPET, ["a"], depth=2)
+
+    assert pool.take("a") == SNIPPET
+    assert pool.size() == 0
@@ -0,0 +1,65 @@
+import pytest
+
+from benchmarks.stub_ai_server import SNIPPET_RESPONSE, StubAIServer
+from debug_duel.snippets import generate_code_snippet
+from hyperskill_ai_api import HyperskillAIAPI
+from llm_cache import LLMCache
+from snippet_parser import SnippetRejected
+from topics import catalog
+
+BUG_LINES = [3, 4, 5]  # of SNIPPET_RESPONSE
+TOPIC = catalog.topics[0]
+
+
+@pytest.fixture
+def server():
+    server = StubAIServer(chunk_delay=0, content="Sorry, I can't write that.").start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def ai_api(server):
+    return HyperskillAIAPI("stub", "stub-model", url=server.url)
+
+
+def test_rejected_snippet_is_not_cached(server, ai_api, tmp_path):
+    cache = LLMCache(str(tmp_path / "snippet_cache.db"))
+    with pytest.raises(SnippetRejected):
+        generate_code_snippet(ai_api, TOPIC, cache=cache)
+    assert cache.export_corpus(str(tmp_path / "corpus.jsonl")) == 0
+
+    server.content = SNIPPET_RESPONSE
+    requests = server.requests
+    assert generate_code_snippet(ai_api, TOPIC, cache=cache)[1] == BUG_LINES
+    assert server.requests == requests + 1
+    assert generate_code_snippet(ai_api, TOPIC, cache=cache)[1] == BUG_LINES
+    assert server.requests == requests + 1
+
+
+def test_prompt_names_the_topic(server, ai_api):
+    prompts = []
+
+    def answer(payload):
+        prompts.append(payload["system"])
+        return SNIPPET_RESPONSE
+
+    server.content = answer
+    generate_code_snippet(ai_api, TOPIC)
+
+    assert f"specified {TOPIC.concept} using the {TOPIC.language}" in prompts[0]
+
+
+def test_recorded_corpus_replays_offline(server, ai_api, tmp_path):
+    server.content = SNIPPET_RESPONSE
+    recorder = LLMCache(str(tmp_path / "recorded.db"), write_only=True)
+    generate_code_snippet(ai_api, TOPIC, cache=recorder)
+    generate_code_snippet(ai_api, TOPIC, cache=recorder)
+    assert server.requests == 2  # a recording cache never answers from its entries
+    corpus = str(tmp_path / "corpus.jsonl")
+    assert recorder.export_corpus(corpus) == 1
+
+    replay = LLMCache(str(tmp_path / "replay.db"), offline=True)
+    replay.import_corpus(corpus)
+    assert generate_code_snippet(ai_api, TOPIC, cache=replay)[1] == BUG_LINES
+    assert server.requests == 2
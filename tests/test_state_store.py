@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from state_store import SqliteStateStore, empty_state, migrate_json_to_sqlite
+
+WORKERS = 8
+
+
+def legacy_state():
+    state = empty_state()
+    for i in range(3):
+        state["users"][f"u{i}"] = {"id": f"u{i}", "username": f"user{i}", "password": "hash", "rating": 1000 + i}
+    return state
+
+
+def write_legacy_file(tmp_path):
+    json_path = str(tmp_path / "game_state.json")
+    with open(json_path, "w") as f:
+        json.dump(legacy_state(), f)
+    return json_path
+
+
+def test_migration_runs_once(tmp_path):
+    json_path = write_legacy_file(tmp_path)
+    store = SqliteStateStore(str(tmp_path / "game_state.db"))
+
+    assert migrate_json_to_sqlite(json_path, store)
+    assert not os.path.exists(json_path) and os.path.exists(json_path + ".migrated")
+    assert not migrate_json_to_sqlite(json_path, store)
+    assert store.count_users() == 3
+
+
+def test_concurrent_workers_import_once(tmp_path):
+    json_path = write_legacy_file(tmp_path)
+    db_path = str(tmp_path / "game_state.db")
+    SqliteStateStore(db_path).count_users()  # the schema, as the first worker to start creates it
+    barrier = threading.Barrier(WORKERS)
+
+    def worker():
+        store = SqliteStateStore(db_path)
+        barrier.wait()
+        return migrate_json_to_sqlite(json_path, store)
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        results = list(pool.map(lambda _: worker(), range(WORKERS)))
+
+    assert results.count(True) == 1
+    assert SqliteStateStore(db_path).count_users() == 3
+    assert os.path.exists(json_path + ".migrated")
+
+
+def test_already_renamed_file_is_tolerated(tmp_path, monkeypatch):
+    json_path = write_legacy_file(tmp_path)
+    store = SqliteStateStore(str(tmp_path / "game_state.db"))
+    # Another worker renames the file between the existence check and the read
+    monkeypatch.setattr(os.path, "exists", lambda path: True)
+    os.replace(json_path, json_path + ".migrated")
+
+    assert not migrate_json_to_sqlite(json_path, store)
+    assert store.count_users() == 0
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import socket
+import threading
+from collections import Counter
+
+import pytest
+
+from events import EventHub
+from stream_server import StreamServer
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def hub():
+    return EventHub()
+
+
+@pytest.fixture
+def server(hub):
+    server = StreamServer(hub, host="127.0.0.1", port=0)
+    threading.Thread(target=asyncio.run, args=(server.serve(),), daemon=True).start()
+    assert server.ready.wait(TIMEOUT)
+    return server
+
+
+def connect(server, token):
+    conn = socket.create_connection(("127.0.0.1", server.port), timeout=TIMEOUT)
+    conn.sendall(f"GET /stream?token={token} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    return conn.makefile("rb")
+
+
+def read_event(stream):
+    while True:
+        line = stream.readline().decode()
+        if line.startswith("data: "):
+            return json.loads(line[len("data: "):])
+
+
+def test_events_reach_only_the_addressed_streams(hub, server):
+    hub.register_token("token-a", "alice")
+    hub.register_token("token-b", "bob")
+    fetches = Counter()
+    fetch_since = hub.fetch_since
+
+    def counting_fetch(user_id, seq=0):
+        fetches[user_id] += 1
+        return fetch_since(user_id, seq)
+
+    hub.fetch_since = counting_fetch
+    alice, bob = connect(server, "token-a"), connect(server, "token-b")
+    while server.connections < 2 or fetches["bob"] < 1:
+        threading.Event().wait(0.01)
+    bob_fetches = fetches["bob"]
+
+    hub.send("alice", "duel_update", {"opponent_errors": 2})
+    assert read_event(alice)["type"] == "duel_update"
+    assert fetches["bob"] == bob_fetches
+
+    hub.broadcast("leaderboard_update", {"leaderboard": []})
+    assert read_event(bob)["type"] == "leaderboard_update"
+
+
+def test_unknown_token_is_refused(server):
+    conn = socket.create_connection(("127.0.0.1", server.port), timeout=TIMEOUT)
+    conn.sendall(b"GET /stream?token=nope HTTP/1.1\r\n\r\n")
+    assert conn.makefile("rb").readline().startswith(b"HTTP/1.1 403")
+    conn.close()
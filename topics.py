@@ -1,3 +1,8 @@
+import random
+import re
+import threading
+from collections import defaultdict, namedtuple
+
 TOPICS_LIST = [
     ("Variable declaration and initialization", "Python"),
     ("Variable declaration and initialization", "Java"),
@@ -123,4 +128,112 @@ TOPICS_LIST = [
     ("Annotations", "Java"),
     ("Attributes", "C++"),
     ("Annotations", "Kotlin")
-]
\ No newline at end of file
+]
+
+Topic = namedtuple("Topic", ["concept", "language", "id"])
+
+REWEIGHT_EVERY = 16  # duels served between two updates of the sampling weights
+
+
+def topic_id(concept, language):
+    """Stable id of a topic, such as "python/recursion"; derived from its text, not its position in TOPICS_LIST."""
+    return f"{slug(language)}/{slug(concept)}"
+
+
+def slug(text):
+    return re.sub(r"[^a-z0-9+]+", "-", text.lower()).strip("-")
+
+
+def alias_table(weights):
+    """Vose's alias tables for `weights`: (probabilities, aliases) to draw an index in O(1)."""
+    count = len(weights)
+    total = sum(weights)
+    scaled = [weight * count / total for weight in weights]
+    probabilities, aliases = [1.0] * count, list(range(count))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less], aliases[less] = scaled[less], more
+        scaled[more] += scaled[less] - 1
+        (small if scaled[more] < 1 else large).append(more)
+    return probabilities, aliases
+
+
+class TopicCatalog:
+    """The duel topics, indexed by id, language and concept.
+
+    `sample` draws a topic in O(1) from alias tables weighted towards the
+    topics this process has served least: a topic served n times more than the
+    least served one weighs 1 / (n + 1). The tables are rebuilt after every
+    `reweight_every` duels recorded with `record_served`, not on every draw.
+    """
+
+    def __init__(self, topics=TOPICS_LIST, reweight_every=REWEIGHT_EVERY):
+        self.topics = [Topic(concept, language, topic_id(concept, language)) for concept, language in topics]
+        self.reweight_every = reweight_every
+        self._by_id = {topic.id: topic for topic in self.topics}
+        if len(self._by_id) != len(self.topics):
+            raise ValueError("Topic ids are not unique")
+        self._by_language = defaultdict(list)
+        self._by_concept = defaultdict(list)
+        for topic in self.topics:
+            self._by_language[topic.language].append(topic)
+            self._by_concept[topic.concept].append(topic)
+        self._served = dict.fromkeys(self._by_id, 0)
+        self._unweighted = 0
+        self._tables = {}  # language (None for all) -> (topics, probabilities, aliases)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.topics)
+
+    def ids(self):
+        return list(self._by_id)
+
+    def get(self, topic_id):
+        """The topic with this id. Raises KeyError."""
+        return self._by_id[topic_id]
+
+    def languages(self):
+        return list(self._by_language)
+
+    def by_language(self, language):
+        return list(self._by_language.get(language, ()))
+
+    def by_concept(self, concept):
+        return list(self._by_concept.get(concept, ()))
+
+    def sample(self, language=None):
+        """Draws a topic, in `language` if given, favouring the least served ones."""
+        with self._lock:
+            table = self._tables.get(language)
+            if table is None:
+                table = self._tables[language] = self._build_table(language)
+        topics, probabilities, aliases = table
+        i = random.randrange(len(topics))
+        return topics[i] if random.random() < probabilities[i] else topics[aliases[i]]
+
+    def record_served(self, topic_id):
+        """Counts a duel played on `topic_id` towards its weight."""
+        with self._lock:
+            self._served[topic_id] += 1
+            self._unweighted += 1
+            if self._unweighted >= self.reweight_every:
+                self._unweighted = 0
+                self._tables.clear()
+
+    def served(self, topic_id):
+        with self._lock:
+            return self._served[topic_id]
+
+    def _build_table(self, language):
+        topics = self.topics if language is None else self._by_language.get(language)
+        if not topics:
+            raise KeyError(language)
+        least = min(self._served[topic.id] for topic in topics)
+        probabilities, aliases = alias_table([1 / (1 + self._served[topic.id] - least) for topic in topics])
+        return topics, probabilities, aliases
+
+
+catalog = TopicCatalog()